@@ -128,6 +128,20 @@ command = bash /data/spug/spug_api/tools/start-scheduler.sh
 autostart = true
 stdout_logfile = /data/spug/spug_api/logs/scheduler.log
 redirect_stderr = true
+
+[program:spug-notify]
+command = bash /data/spug/spug_api/tools/start-notify.sh
+autostart = true
+stdout_logfile = /data/spug/spug_api/logs/notify.log
+redirect_stderr = true
+
+[program:spug-deployer]
+command = bash /data/spug/spug_api/tools/start-deployer.sh
+autostart = true
+stdout_logfile = /data/spug/spug_api/logs/deployer.log
+redirect_stderr = true
+stopasgroup = true
+killasgroup = true
 EOF
 
 cat << EOF > /etc/nginx/conf.d/spug.conf
@@ -142,6 +156,14 @@ server {
                 proxy_set_header X-Real-IP \$remote_addr;
         }
 
+        location ^~ /api/apis/config/watch/ {
+                rewrite ^/api(.*) \$1 break;
+                proxy_pass http://127.0.0.1:9002;
+                proxy_buffering off;
+                proxy_read_timeout 150s;
+                proxy_set_header X-Real-IP \$remote_addr;
+        }
+
         location ^~ /api/ws/ {
                 rewrite ^/api(.*) \$1 break;
                 proxy_pass http://127.0.0.1:9002;
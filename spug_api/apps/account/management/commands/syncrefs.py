@@ -0,0 +1,21 @@
+# Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
+# Copyright: (c) <spug.dev@gmail.com>
+# Released under the AGPL-3.0 License.
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.account.models import Role
+from apps.alarm.models import Group
+from apps.app.models import Deploy
+from apps.monitor.models import Detection
+from apps.schedule.models import Task
+
+
+class Command(BaseCommand):
+    help = '根据json字段重建主机、报警组及联系人的关联表'
+
+    def handle(self, *args, **options):
+        for model in (Deploy, Task, Role, Detection, Group):
+            with transaction.atomic():
+                for obj in model.objects.all():
+                    obj.sync_refs()
+        self.stdout.write(self.style.SUCCESS('关联表同步完成'))
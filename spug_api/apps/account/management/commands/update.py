@@ -58,7 +58,8 @@ class Command(BaseCommand):
         commands = [
             f'cd {settings.BASE_DIR}',
             f'python3 ./manage.py makemigrations ' + ' '.join(apps),
-            f'python3 ./manage.py migrate'
+            f'python3 ./manage.py migrate',
+            f'python3 ./manage.py syncrefs'
         ]
         task = subprocess.Popen(' && '.join(commands), shell=True)
         if task.wait() != 0:
@@ -14,4 +14,5 @@ class Command(BaseCommand):
         apps = [x.split('.')[-1] for x in settings.INSTALLED_APPS if x.startswith('apps.')]
         execute_from_command_line(args + apps)
         execute_from_command_line(['manage.py', 'migrate'])
+        execute_from_command_line(['manage.py', 'syncrefs'])
         self.stdout.write(self.style.SUCCESS('初始化/更新成功'))
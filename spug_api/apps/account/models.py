@@ -4,9 +4,35 @@
 from django.db import models
 from libs import ModelMixin, human_datetime
 from django.contrib.auth.hashers import make_password, check_password
+from functools import lru_cache
 import json
 
 
+class RolePerms:
+    """
+    预编译的角色权限，列表用于接口返回，集合用于权限判断
+    """
+
+    def __init__(self, page_perms, deploy_perms, host_perms, category_perms):
+        pages = json.loads(page_perms) if page_perms else {}
+        deploys = json.loads(deploy_perms) if deploy_perms else {}
+        self.page_perms = tuple(f'{m}.{p}.{x}' for m, v in pages.items() for p, d in v.items() for x in d)
+        self.apps = tuple(deploys.get('apps', []))
+        self.envs = tuple(deploys.get('envs', []))
+        self.host_perms = tuple(json.loads(host_perms) if host_perms else [])
+        self.category_perms = tuple(json.loads(category_perms) if category_perms else [])
+        self.host_set = frozenset(self.host_perms)
+
+
+@lru_cache(maxsize=256)
+def compile_perms(page_perms, deploy_perms, host_perms, category_perms):
+    # 以权限原文为缓存键，角色权限被修改后自然失效
+    return RolePerms(page_perms, deploy_perms, host_perms, category_perms)
+
+
+EMPTY_PERMS = RolePerms(None, None, None, None)
+
+
 class User(models.Model, ModelMixin):
     username = models.CharField(max_length=100)
     nickname = models.CharField(max_length=100)
@@ -32,37 +58,33 @@ class User(models.Model, ModelMixin):
     def verify_password(self, plain_password: str) -> bool:
         return check_password(plain_password, self.password_hash)
 
+    @property
+    def perms(self):
+        return self.role.perms if self.role else EMPTY_PERMS
+
     @property
     def page_perms(self):
-        if self.role and self.role.page_perms:
-            data = []
-            perms = json.loads(self.role.page_perms)
-            for m, v in perms.items():
-                for p, d in v.items():
-                    data.extend(f'{m}.{p}.{x}' for x in d)
-            return data
-        else:
-            return []
+        return list(self.perms.page_perms)
 
     @property
     def deploy_perms(self):
-        perms = json.loads(self.role.deploy_perms) if self.role and self.role.deploy_perms else {}
-        perms.setdefault('apps', [])
-        perms.setdefault('envs', [])
-        return perms
+        perms = self.perms
+        return {'apps': list(perms.apps), 'envs': list(perms.envs)}
 
     @property
     def host_perms(self):
-        return json.loads(self.role.host_perms) if self.role and self.role.host_perms else []
+        return list(self.perms.host_perms)
 
     @property
     def category_perms(self):
-        return json.loads(self.role.category_perms) if self.role and self.role.category_perms else []
+        return list(self.perms.category_perms)
 
     def has_host_perm(self, host_id):
+        if self.is_supper:
+            return True
         if isinstance(host_id, (list, set, tuple)):
-            return self.is_supper or set(host_id).issubset(set(self.host_perms))
-        return self.is_supper or int(host_id) in self.host_perms
+            return self.perms.host_set.issuperset(host_id)
+        return int(host_id) in self.perms.host_set
 
     def has_perms(self, codes):
         # return self.is_supper or self.role in codes
@@ -83,6 +105,7 @@ class Role(models.Model, ModelMixin):
     deploy_perms = models.TextField(null=True)
     host_perms = models.TextField(null=True)
     category_perms = models.TextField(null=True)
+    hosts = models.ManyToManyField('host.Host', related_name='roles', db_table='role_hosts')
 
     created_at = models.CharField(max_length=20, default=human_datetime)
     created_by = models.ForeignKey(User, on_delete=models.PROTECT, related_name='+')
@@ -96,6 +119,10 @@ class Role(models.Model, ModelMixin):
         tmp['used'] = self.user_set.count()
         return tmp
 
+    @property
+    def perms(self):
+        return compile_perms(self.page_perms, self.deploy_perms, self.host_perms, self.category_perms)
+
     def add_deploy_perm(self, target, value):
         perms = {'apps': [], 'envs': []}
         if self.deploy_perms:
@@ -104,11 +131,12 @@ class Role(models.Model, ModelMixin):
         self.deploy_perms = json.dumps(perms)
         self.save()
 
-    def add_host_perm(self, value):
+    def add_host_perm(self, *values):
         perms = json.loads(self.host_perms) if self.host_perms else []
-        perms.append(value)
+        perms.extend(values)
         self.host_perms = json.dumps(perms)
         self.save()
+        self.hosts.add(*values)
 
     def add_category_perms(self, value):
         perms = json.loads(self.category_perms) if self.category_perms else []
@@ -117,6 +145,9 @@ class Role(models.Model, ModelMixin):
             self.category_perms = json.dumps(perms)
             self.save()
 
+    def sync_refs(self):
+        self.set_refs('hosts', json.loads(self.host_perms) if self.host_perms else [])
+
     def __repr__(self):
         return '<Role name=%r>' % self.name
 
@@ -0,0 +1,35 @@
+# Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
+# Copyright: (c) <spug.dev@gmail.com>
+# Released under the AGPL-3.0 License.
+from django.core.cache import cache
+from apps.account.models import User
+import time
+
+SESSION_KEY = 'spug:session'
+TOKEN_TTL = 8 * 60 * 60
+# 令牌的滑动过期时间最多每隔该时长(秒)写回一次数据库
+TOKEN_REFRESH = 5 * 60
+
+
+def get_user_by_token(access_token):
+    """
+    令牌到用户ID的映射缓存在Redis中，避免按未建索引的 access_token 查询，
+    用户信息仍按主键实时读取，禁用、改密、角色变更等操作可立即生效
+    """
+    key = f'{SESSION_KEY}:{access_token}'
+    user_id = cache.get(key)
+    if user_id:
+        user = User.objects.select_related('role').filter(pk=user_id).first()
+        if user and user.access_token == access_token:
+            return user
+    user = User.objects.select_related('role').filter(access_token=access_token).first()
+    if user:
+        cache.set(key, user.id, TOKEN_TTL)
+    return user
+
+
+def refresh_token(user):
+    expired = int(time.time()) + TOKEN_TTL
+    if expired - user.token_expired >= TOKEN_REFRESH:
+        User.objects.filter(pk=user.id).update(token_expired=expired)
+        user.token_expired = expired
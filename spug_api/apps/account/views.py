@@ -120,6 +120,8 @@ class RoleView(View):
                 role.host_perms = json.dumps(host_perms)
             role.user_set.update(token_expired=0)
             role.save()
+            if form.host_perms is not None or form.category_perms is not None:
+                role.sync_refs()
         return json_response(error=error)
 
     def delete(self, request):
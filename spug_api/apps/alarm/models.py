@@ -46,6 +46,7 @@ class Group(models.Model, ModelMixin):
     name = models.CharField(max_length=50)
     desc = models.CharField(max_length=255, null=True)
     contacts = models.TextField(null=True)
+    members = models.ManyToManyField('Contact', related_name='groups', db_table='alarm_group_contacts')
     created_at = models.CharField(max_length=20, default=human_datetime)
     created_by = models.ForeignKey(User, models.PROTECT, related_name='+')
 
@@ -54,6 +55,9 @@ class Group(models.Model, ModelMixin):
         tmp['contacts'] = json.loads(self.contacts)
         return tmp
 
+    def sync_refs(self):
+        self.set_refs('members', json.loads(self.contacts) if self.contacts else [])
+
     def __repr__(self):
         return '<AlarmGroup %r>' % self.name
 
@@ -1,9 +1,38 @@
 # Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
 # Released under the AGPL-3.0 License.
-from apps.alarm.models import Alarm
+from django.core.cache import cache
+from apps.alarm.models import Alarm, Group, Contact
 from datetime import datetime, timedelta
+import json
+
+RECIPIENTS_KEY = 'spug:alarm:recipients'
+RECIPIENT_FIELDS = ('wx_token', 'ding', 'email', 'qy_wx', 'phone')
 
 
 def auto_clean_records():
     date = datetime.now() - timedelta(days=30)
     Alarm.objects.filter(created_at__lt=date.strftime('%Y-%m-%d')).delete()
+
+
+def get_recipients(grp):
+    """
+    解析报警组下各通知渠道的接收地址，按报警组集合缓存，返回 {渠道字段: [地址]}
+    """
+    key = f'{RECIPIENTS_KEY}:{",".join(sorted(str(x) for x in grp))}'
+    recipients = cache.get(key)
+    if recipients is None:
+        u_ids = set()
+        for contacts in Group.objects.filter(id__in=grp).values_list('contacts', flat=True):
+            u_ids.update(json.loads(contacts or '[]'))
+        recipients = {x: set() for x in RECIPIENT_FIELDS}
+        for item in Contact.objects.filter(id__in=u_ids).values(*RECIPIENT_FIELDS):
+            for field in RECIPIENT_FIELDS:
+                if item[field]:
+                    recipients[field].add(item[field])
+        recipients = {k: sorted(v) for k, v in recipients.items()}
+        cache.set(key, recipients, 3600)
+    return recipients
+
+
+def clear_recipients():
+    cache.delete_pattern(f'{RECIPIENTS_KEY}:*')
@@ -2,8 +2,10 @@
 # Copyright: (c) <spug.dev@gmail.com>
 # Released under the AGPL-3.0 License.
 from django.views.generic import View
+from django.db import transaction
 from libs import json_response, JsonParser, Argument
 from apps.alarm.models import Alarm, Group, Contact
+from apps.alarm.utils import clear_recipients
 from apps.monitor.models import Detection
 import json
 
@@ -30,9 +32,14 @@ class GroupView(View):
             form.contacts = json.dumps(form.contacts)
             if form.id:
                 Group.objects.filter(pk=form.id).update(**form)
+                group = Group.objects.filter(pk=form.id).first()
+                if not group:
+                    return json_response(error='未找到指定报警组')
             else:
                 form.created_by = request.user
-                Group.objects.create(**form)
+                group = Group.objects.create(**form)
+            group.sync_refs()
+            transaction.on_commit(clear_recipients)
         return json_response(error=error)
 
     def delete(self, request):
@@ -40,10 +47,11 @@ class GroupView(View):
             Argument('id', type=int, help='请指定操作对象')
         ).parse(request.GET)
         if error is None:
-            detection = Detection.objects.filter(notify_grp__regex=fr'\D{form.id}\D').first()
+            detection = Detection.objects.filter(groups=form.id).first()
             if detection:
                 return json_response(error=f'监控任务【{detection.name}】正在使用该报警组，请解除关联后再尝试删除该联系组')
             Group.objects.filter(pk=form.id).delete()
+            transaction.on_commit(clear_recipients)
         return json_response(error=error)
 
 
@@ -68,6 +76,7 @@ class ContactView(View):
             else:
                 form.created_by = request.user
                 Contact.objects.create(**form)
+            transaction.on_commit(clear_recipients)
         return json_response(error=error)
 
     def delete(self, request):
@@ -75,8 +84,9 @@ class ContactView(View):
             Argument('id', type=int, help='请指定操作对象')
         ).parse(request.GET)
         if error is None:
-            group = Group.objects.filter(contacts__contains=f'\"{form.id}\"').first()
+            group = Group.objects.filter(members=form.id).first()
             if group:
                 return json_response(error=f'报警联系组【{group.name}】包含此联系人，请解除关联后再尝试删除该联系人')
             Contact.objects.filter(pk=form.id).delete()
+            transaction.on_commit(clear_recipients)
         return json_response(error=error)
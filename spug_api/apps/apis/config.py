@@ -2,71 +2,152 @@
 # Copyright: (c) <spug.dev@gmail.com>
 # Released under the AGPL-3.0 License.
 from django.http.response import HttpResponse
+from django.db.models import Q
 from django_redis import get_redis_connection
 from apps.config.models import Config, Service, Environment
+from apps.config.utils import get_config_version
 from apps.setting.utils import AppSetting
 from apps.app.models import App
+from libs import JsonParser, Argument
+import hashlib
 import json
 
+SNAPSHOT_KEY = 'spug:config:snapshot'
+SNAPSHOT_TTL = 3600
+FORMATS = {
+    'kv': 'text/plain; charset=utf-8',
+    'env': 'text/plain; charset=utf-8',
+    'json': 'application/json',
+}
+
 
 def get_configs(request):
-    data = {}
     app, env_id, no_prefix = _parse_params(request)
     if not app or not env_id:
         return HttpResponse('Invalid params', status=400)
-    # app own configs
-    for item in Config.objects.filter(type='app', o_id=app.id, env_id=env_id).only('key', 'value'):
-        key = item.key if no_prefix else f'{app.key}_{item.key}'
-        data[key] = item.value
-
-    # relation app public configs
-    if app.rel_apps:
-        app_ids = json.loads(app.rel_apps)
-        if app_ids:
-            id_key_map = {x.id: x.key for x in App.objects.filter(id__in=app_ids)}
-            for item in Config.objects.filter(type='app', o_id__in=app_ids, env_id=env_id, is_public=True) \
-                    .only('key', 'value'):
-                key = item.key if no_prefix else f'{id_key_map[item.o_id]}_{item.key}'
-                data[key] = item.value
-
-    # relation service configs
-    if app.rel_services:
-        src_ids = json.loads(app.rel_services)
-        if src_ids:
-            id_key_map = {x.id: x.key for x in Service.objects.filter(id__in=src_ids)}
-            for item in Config.objects.filter(type='src', o_id__in=src_ids, env_id=env_id).only('key', 'value'):
-                key = item.key if no_prefix else f'{id_key_map[item.o_id]}_{item.key}'
-                data[key] = item.value
-
-    # format
     fmt = request.GET.get('format', 'kv')
-    if fmt == 'kv':
-        return _kv_response(data)
-    elif fmt == 'env':
-        return _env_response(data)
-    elif fmt == 'json':
-        return _json_response(data)
-    else:
+    if fmt not in FORMATS:
         return HttpResponse('Unsupported output format', status=400)
+    output, etag = get_snapshot(app, env_id, no_prefix, fmt)
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(output, content_type=FORMATS[fmt])
+    response['ETag'] = etag
+    return response
 
 
-def _kv_response(data):
-    output = ''
-    for k, v in sorted(data.items()):
-        output += f'{k} = {v}\r\n'
-    return HttpResponse(output, content_type='text/plain; charset=utf-8')
+def get_snapshot(app, env_id, no_prefix, fmt, rds=None):
+    """
+    按配置版本缓存渲染后的配置内容，任意配置变更都会递增版本使旧快照失效，
+    ETag 取自渲染结果的摘要，仅在该应用的配置内容变化时改变
+    """
+    rds = rds or get_redis_connection()
+    version = get_config_version(rds)
+    key = f'{SNAPSHOT_KEY}:{version}:{app.id}:{env_id}:{1 if no_prefix else 0}:{fmt}'
+    snapshot = rds.get(key)
+    if snapshot:
+        etag, output = snapshot.decode().split('\n', 1)
+    else:
+        data = compile_configs(app, env_id, no_prefix)
+        output = _render(data, fmt)
+        etag = '"%s"' % hashlib.md5(output.encode()).hexdigest()
+        rds.set(key, f'{etag}\n{output}', SNAPSHOT_TTL)
+    return output, etag
+
+
+def get_bulk_configs(request):
+    """
+    批量获取多个应用/环境的配置，请求体为 {"targets": [{"app": 应用标识, "env": 环境标识}]}，
+    返回与 targets 顺序一致的配置列表，无效的应用或环境返回 error
+    """
+    api_key = AppSetting.get_default('api_key')
+    if not api_key or request.GET.get('apiKey') != api_key:
+        return HttpResponse('Invalid params', status=400)
+    form, error = JsonParser(
+        Argument('targets', type=list, filter=lambda x: all(isinstance(i, dict) for i in x), help='Invalid targets'),
+    ).parse(request.body)
+    if error is not None:
+        return HttpResponse(error, status=400)
+    app_keys = set(str(x.get('app')) for x in form.targets)
+    env_keys = set(str(x.get('env')) for x in form.targets)
+    apps = {x.key: x for x in App.objects.filter(key__in=app_keys)}
+    envs = {x.key: x.id for x in Environment.objects.filter(key__in=env_keys)}
+    pairs, response = [], []
+    for item in form.targets:
+        app, env_id = apps.get(str(item.get('app'))), envs.get(str(item.get('env')))
+        response.append({'app': item.get('app'), 'env': item.get('env')})
+        if app and env_id:
+            pairs.append((len(response) - 1, app, env_id))
+        else:
+            response[-1]['error'] = 'Invalid app or env'
+    datas = compile_bulk([(app, env_id) for _, app, env_id in pairs], request.GET.get('noPrefix'))
+    for (index, _, _), data in zip(pairs, datas):
+        response[index]['configs'] = dict(sorted(data.items()))
+    return HttpResponse(json.dumps(response), content_type='application/json')
 
 
-def _env_response(data):
-    output = ''
-    for k, v in sorted(data.items()):
-        output += f'{k}={v}\n'
-    return HttpResponse(output, content_type='text/plain; charset=utf-8')
+def compile_configs(app, env_id, no_prefix):
+    return compile_bulk([(app, env_id)], no_prefix)[0]
 
 
-def _json_response(data):
-    data = dict(sorted(data.items()))
-    return HttpResponse(json.dumps(data), content_type='application/json')
+def compile_bulk(pairs, no_prefix):
+    """
+    解析多个(应用, 环境ID)的最终配置，关联应用和服务的标识一次查询，
+    所有配置项通过一次 o_id__in 查询加载
+    """
+    rel_apps, rel_services = {}, {}
+    app_ids, src_ids, env_ids = set(), set(), set()
+    for app, env_id in pairs:
+        rel_apps[app.id] = json.loads(app.rel_apps) if app.rel_apps else []
+        rel_services[app.id] = json.loads(app.rel_services) if app.rel_services else []
+        app_ids.add(app.id)
+        app_ids.update(rel_apps[app.id])
+        src_ids.update(rel_services[app.id])
+        env_ids.add(env_id)
+    app_key_map = {x.id: x.key for x in App.objects.filter(id__in=app_ids).only('key')}
+    src_key_map = {x.id: x.key for x in Service.objects.filter(id__in=src_ids).only('key')} if src_ids else {}
+
+    configs = {}
+    query = Q(type='app', o_id__in=app_ids)
+    if src_ids:
+        query |= Q(type='src', o_id__in=src_ids)
+    fields = ('type', 'o_id', 'env_id', 'key', 'value', 'is_public')
+    for item in Config.objects.filter(query, env_id__in=env_ids).only(*fields):
+        configs.setdefault((item.type, item.o_id, item.env_id), []).append(item)
+
+    result = []
+    for app, env_id in pairs:
+        data = {}
+        # app own configs
+        for item in configs.get(('app', app.id, env_id), []):
+            key = item.key if no_prefix else f'{app.key}_{item.key}'
+            data[key] = item.value
+
+        # relation app public configs
+        for o_id in rel_apps[app.id]:
+            for item in configs.get(('app', o_id, env_id), []):
+                if item.is_public and o_id in app_key_map:
+                    key = item.key if no_prefix else f'{app_key_map[o_id]}_{item.key}'
+                    data[key] = item.value
+
+        # relation service configs
+        for o_id in rel_services[app.id]:
+            for item in configs.get(('src', o_id, env_id), []):
+                if o_id in src_key_map:
+                    key = item.key if no_prefix else f'{src_key_map[o_id]}_{item.key}'
+                    data[key] = item.value
+        result.append(data)
+    return result
+
+
+def _render(data, fmt):
+    items = sorted(data.items())
+    if fmt == 'kv':
+        return ''.join(f'{k} = {v}\r\n' for k, v in items)
+    elif fmt == 'env':
+        return ''.join(f'{k}={v}\n' for k, v in items)
+    return json.dumps(dict(items))
 
 
 def _parse_params(request):
@@ -76,7 +157,7 @@ def _parse_params(request):
         rds = get_redis_connection()
         content = rds.get(api_token)
         if content:
-            app_id, env_id = content.decode().split(',')
+            app_id, env_id = map(int, content.decode().split(','))
             app = App.objects.filter(pk=app_id).first()
     else:
         api_key = AppSetting.get_default('api_key')
@@ -7,4 +7,5 @@ from apps.apis import config
 
 urlpatterns = [
     path('config/', config.get_configs),
+    path('config/bulk/', config.get_bulk_configs),
 ]
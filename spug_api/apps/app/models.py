@@ -39,6 +39,7 @@ class Deploy(models.Model, ModelMixin):
     app = models.ForeignKey(App, on_delete=models.PROTECT)
     env = models.ForeignKey(Environment, on_delete=models.PROTECT)
     host_ids = models.TextField()
+    hosts = models.ManyToManyField('host.Host', related_name='deploys', db_table='deploy_hosts')
     extend = models.CharField(max_length=2, choices=EXTENDS)
     is_audit = models.BooleanField()
     rst_notify = models.CharField(max_length=255, null=True)
@@ -61,6 +62,9 @@ class Deploy(models.Model, ModelMixin):
         deploy.update(self.extend_obj.to_dict())
         return deploy
 
+    def sync_refs(self):
+        self.set_refs('hosts', json.loads(self.host_ids))
+
     def __repr__(self):
         return '<Deploy app_id=%r>' % self.app_id
 
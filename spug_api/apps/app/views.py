@@ -3,10 +3,12 @@
 # Released under the AGPL-3.0 License.
 from django.views.generic import View
 from django.db.models import F
+from django.db import transaction
 from django.conf import settings
 from libs import JsonParser, Argument, json_response
 from apps.app.models import App, Deploy, DeployExtend1, DeployExtend2
 from apps.config.models import Config
+from apps.config.utils import bump_config_version
 from apps.app.utils import parse_envs, fetch_versions, remove_repo
 import subprocess
 import json
@@ -35,6 +37,7 @@ class AppView(View):
                 return json_response(error=f'唯一标识符 {form.key} 已存在，请更改后重试')
             if form.id:
                 App.objects.filter(pk=form.id).update(**form)
+                transaction.on_commit(bump_config_version)
             else:
                 app = App.objects.create(created_by=request.user, **form)
                 if request.user.role:
@@ -54,6 +57,7 @@ class AppView(View):
             app.rel_apps = json.dumps(form.rel_apps)
             app.rel_services = json.dumps(form.rel_services)
             app.save()
+            transaction.on_commit(bump_config_version)
         return json_response(error=error)
 
     def delete(self, request):
@@ -117,13 +121,19 @@ class DeployView(View):
                 extend_form.custom_envs = json.dumps(parse_envs(extend_form.custom_envs))
                 if form.id:
                     extend = DeployExtend1.objects.filter(deploy_id=form.id).first()
+                    if not extend:
+                        return json_response(error='未找到指定发布配置')
                     if extend.git_repo != extend_form.git_repo:
                         remove_repo(form.id)
                     Deploy.objects.filter(pk=form.id).update(**form)
                     DeployExtend1.objects.filter(deploy_id=form.id).update(**extend_form)
+                    deploy = Deploy.objects.filter(pk=form.id).first()
+                    if not deploy:
+                        return json_response(error='未找到指定发布配置')
                 else:
                     deploy = Deploy.objects.create(created_by=request.user, **form)
                     DeployExtend1.objects.create(deploy=deploy, **extend_form)
+                deploy.sync_refs()
             elif form.extend == '2':
                 extend_form, error = JsonParser(
                     Argument('server_actions', type=list, help='请输入执行动作'),
@@ -138,9 +148,13 @@ class DeployView(View):
                 if form.id:
                     Deploy.objects.filter(pk=form.id).update(**form)
                     DeployExtend2.objects.filter(deploy_id=form.id).update(**extend_form)
+                    deploy = Deploy.objects.filter(pk=form.id).first()
+                    if not deploy:
+                        return json_response(error='未找到指定发布配置')
                 else:
                     deploy = Deploy.objects.create(created_by=request.user, **form)
                     DeployExtend2.objects.create(deploy=deploy, **extend_form)
+                deploy.sync_refs()
         return json_response(error=error)
 
     def delete(self, request):
@@ -0,0 +1,23 @@
+# Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
+# Copyright: (c) <spug.dev@gmail.com>
+# Released under the AGPL-3.0 License.
+from django_redis import get_redis_connection
+
+CONFIG_VERSION_KEY = 'spug:config:version'
+
+
+def get_config_version(rds=None):
+    rds = rds or get_redis_connection()
+    version = rds.get(CONFIG_VERSION_KEY)
+    return int(version) if version else 0
+
+
+def bump_config_version():
+    """
+    配置、应用依赖或服务标识变更后调用，使所有配置快照失效并通知配置监听请求，
+    监听请求收到通知后立即重新读取配置，因此需通过 transaction.on_commit 在事务提交后调用
+    """
+    rds = get_redis_connection()
+    version = rds.incr(CONFIG_VERSION_KEY)
+    rds.publish(CONFIG_VERSION_KEY, version)
+    return version
@@ -3,9 +3,11 @@
 # Released under the AGPL-3.0 License.
 from django.views.generic import View
 from django.db.models import F
+from django.db import transaction
 from libs import json_response, JsonParser, Argument
 from apps.app.models import Deploy
 from apps.config.models import *
+from apps.config.utils import bump_config_version
 import json
 
 
@@ -70,6 +72,7 @@ class ServiceView(View):
                 Service.objects.filter(pk=form.id).update(**form)
             else:
                 Service.objects.create(created_by=request.user, **form)
+            transaction.on_commit(bump_config_version)
         return json_response(error=error)
 
     def delete(self, request):
@@ -117,6 +120,7 @@ class ConfigView(View):
             for env_id in envs:
                 Config.objects.create(env_id=env_id, **form)
                 ConfigHistory.objects.create(action='1', env_id=env_id, **form)
+            transaction.on_commit(bump_config_version)
         return json_response(error=error)
 
     def patch(self, request):
@@ -143,6 +147,7 @@ class ConfigView(View):
                     old_value=old_value,
                     **config.to_dict(excludes=('id',)))
             config.save()
+            transaction.on_commit(bump_config_version)
         return json_response(error=error)
 
     def delete(self, request):
@@ -161,6 +166,7 @@ class ConfigView(View):
                     **config.to_dict(excludes=('id', 'value', 'updated_at', 'updated_by_id'))
                 )
                 config.delete()
+                transaction.on_commit(bump_config_version)
         return json_response(error=error)
 
 
@@ -264,6 +270,7 @@ def _parse(request, query, data):
         query.updated_by = request.user
         Config.objects.create(**query)
         ConfigHistory.objects.create(action='1', **query)
+    transaction.on_commit(bump_config_version)
 
 
 def _filter_value(value):
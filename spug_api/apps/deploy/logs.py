@@ -0,0 +1,129 @@
+# Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
+# Copyright: (c) <spug.dev@gmail.com>
+# Released under the AGPL-3.0 License.
+from django_redis import get_redis_connection
+from django.conf import settings
+import tempfile
+import uuid
+import gzip
+import json
+import os
+
+# 发布中的日志暂存于Redis列表，到期自动删除，防止异常中断的发布日志长期占用内存
+LIVE_TTL = 3 * 24 * 3600
+# 从Redis读取日志时每次LRANGE的条数
+READ_WINDOW = 1000
+# 归档锁的过期时长(秒)，防止发布进程与查看日志的请求同时归档同一发布申请
+COMPACT_LOCK_TTL = 60
+
+
+def _live_key(r_id):
+    return f'{settings.REQUEST_KEY}:{r_id}'
+
+
+def _lock_key(r_id):
+    return f'{settings.REQUEST_KEY}:compact:{r_id}'
+
+
+def _paths(r_id):
+    path = os.path.join(settings.DEPLOY_LOGS_DIR, str(r_id))
+    return f'{path}.log.gz', f'{path}.idx'
+
+
+def append(rds, r_id, message):
+    """
+    追加一条发布日志，message 为json字符串，rds 可以是pipeline
+    """
+    key = _live_key(r_id)
+    rds.lpush(key, message)
+    rds.expire(key, LIVE_TTL)
+
+
+def _read_live(rds, key):
+    # 新日志写入列表头部，从尾部按负索引分批读取，不受读取期间的写入影响
+    start = 0
+    while True:
+        items = rds.lrange(key, -(start + READ_WINDOW), -(start + 1))
+        yield from reversed(items)
+        if len(items) < READ_WINDOW:
+            break
+        start += READ_WINDOW
+
+
+def compact(r_id, rds=None):
+    """
+    将Redis中的发布日志按主机分段压缩写入文件，每台主机为一个独立的gzip段，
+    索引文件记录各段的 [偏移量, 字节数, 消息条数]，写入完成后删除Redis中的日志，
+    其他进程正在归档或没有待归档的日志时直接返回False
+    """
+    rds = rds or get_redis_connection()
+    key, lock_key, lock_id = _live_key(r_id), _lock_key(r_id), uuid.uuid4().hex
+    if not rds.exists(key) or not rds.set(lock_key, lock_id, nx=True, ex=COMPACT_LOCK_TTL):
+        return False
+    try:
+        return _compact(rds, r_id, key)
+    finally:
+        if rds.get(lock_key) == lock_id.encode():
+            rds.delete(lock_key)
+
+
+def _compact(rds, r_id, key):
+    segments = {}
+    for item in _read_live(rds, key):
+        segments.setdefault(str(json.loads(item)['key']), []).append(item)
+    if not segments:
+        return False
+
+    os.makedirs(settings.DEPLOY_LOGS_DIR, exist_ok=True)
+    log_path, idx_path = _paths(r_id)
+    log_tmp = tempfile.NamedTemporaryFile('wb', dir=settings.DEPLOY_LOGS_DIR, suffix='.tmp', delete=False)
+    idx_tmp = tempfile.NamedTemporaryFile('w', dir=settings.DEPLOY_LOGS_DIR, suffix='.tmp', delete=False)
+    try:
+        index, offset = {}, 0
+        with log_tmp, idx_tmp:
+            for name, lines in segments.items():
+                data = gzip.compress(b'\n'.join(lines))
+                log_tmp.write(data)
+                index[name] = [offset, len(data), len(lines)]
+                offset += len(data)
+            json.dump(index, idx_tmp)
+        os.replace(log_tmp.name, log_path)
+        os.replace(idx_tmp.name, idx_path)
+    except Exception:
+        for path in (log_tmp.name, idx_tmp.name):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    rds.delete(key)
+    return True
+
+
+def read(r_id, keys=None, rds=None):
+    """
+    按时间顺序返回发布日志（json字符串），已压缩归档的日志按主机分段依次返回，
+    keys 不为空时仅返回指定主机（或local）的日志，归档日志只解压对应的分段
+    """
+    keys = set(str(x) for x in keys) if keys else None
+    log_path, idx_path = _paths(r_id)
+    if os.path.exists(idx_path):
+        with open(idx_path) as f:
+            index = json.load(f)
+        with open(log_path, 'rb') as f:
+            for name, (offset, length, _) in index.items():
+                if keys is None or name in keys:
+                    f.seek(offset)
+                    yield from gzip.decompress(f.read(length)).decode().split('\n')
+    else:
+        rds = rds or get_redis_connection()
+        for item in _read_live(rds, _live_key(r_id)):
+            item = item.decode()
+            if keys is None or str(json.loads(item)['key']) in keys:
+                yield item
+
+
+def remove(r_id, rds=None):
+    rds = rds or get_redis_connection()
+    rds.delete(_live_key(r_id))
+    for path in _paths(r_id):
+        if os.path.exists(path):
+            os.remove(path)
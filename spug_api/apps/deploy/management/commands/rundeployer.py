@@ -0,0 +1,16 @@
+# Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
+# Copyright: (c) <spug.dev@gmail.com>
+# Released under the AGPL-3.0 License.
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from apps.deploy.worker import run
+
+
+class Command(BaseCommand):
+    help = 'Start deploy worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-w', '--workers', type=int, default=settings.DEPLOY_WORKERS, help='工作进程数量')
+
+    def handle(self, *args, **options):
+        run(options['workers'])
@@ -29,6 +29,8 @@ class DeployRequest(models.Model, ModelMixin):
     status = models.CharField(max_length=2, choices=STATUS)
     reason = models.CharField(max_length=255, null=True)
     version = models.CharField(max_length=50, null=True)
+    # 各发布步骤的耗时记录，json列表，参考 Helper.span
+    spans = models.TextField(null=True)
 
     created_at = models.CharField(max_length=20, default=human_datetime)
     created_by = models.ForeignKey(User, models.PROTECT, related_name='+')
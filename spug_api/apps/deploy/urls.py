@@ -8,5 +8,7 @@ from .views import *
 urlpatterns = [
     path('request/', RequestView.as_view()),
     path('request/upload/', do_upload),
+    path('request/queue/', get_queue),
+    path('request/spans/', get_spans),
     path('request/<int:r_id>/', RequestDetailView.as_view()),
 ]
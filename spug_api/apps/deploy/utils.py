@@ -5,12 +5,15 @@ from django_redis import get_redis_connection
 from django.conf import settings
 from libs.utils import AttrDict, human_time, human_datetime
 from apps.host.models import Host
-from apps.notify.models import Notify
+from apps.notify.outbox import push
+from apps.deploy import logs
 from concurrent import futures
-import requests
+from contextlib import contextmanager
+from threading import local, Lock
 import subprocess
 import json
 import uuid
+import time
 import os
 
 REPOS_DIR = settings.REPOS_DIR
@@ -20,12 +23,12 @@ class SpugError(Exception):
     pass
 
 
-def deploy_dispatch(request, req, token):
+def deploy_dispatch(req, token):
     rds = get_redis_connection()
+    helper = Helper(rds, token, req.id)
     try:
         api_token = uuid.uuid4().hex
         rds.setex(api_token, 60 * 60, f'{req.deploy.app_id},{req.deploy.env_id}')
-        helper = Helper(rds, token, req.id)
         helper.send_step('local', 1, f'完成\r\n{human_time()} 发布准备...        ')
         env = AttrDict(
             SPUG_APP_NAME=req.deploy.app.name,
@@ -40,20 +43,23 @@ def deploy_dispatch(request, req, token):
             SPUG_API_TOKEN=api_token,
             SPUG_REPOS_DIR=REPOS_DIR,
         )
-        if req.deploy.extend == '1':
-            env.update(json.loads(req.deploy.extend_obj.custom_envs))
-            _ext1_deploy(req, helper, env)
-        else:
-            _ext2_deploy(req, helper, env)
+        with helper.span('local', 'total'):
+            if req.deploy.extend == '1':
+                env.update(json.loads(req.deploy.extend_obj.custom_envs))
+                _ext1_deploy(req, helper, env)
+            else:
+                _ext2_deploy(req, helper, env)
         req.status = '3'
     except Exception as e:
         req.status = '-3'
         raise e
     finally:
         rds.expire(token, 5 * 60)
-        rds.close()
+        req.spans = json.dumps(helper.spans)
         req.save()
         Helper.send_deploy_notify(req)
+        logs.compact(req.id, rds)
+        rds.close()
 
 
 def _ext1_deploy(req, helper, env):
@@ -69,22 +75,26 @@ def _ext1_deploy(req, helper, env):
     if req.type == '2':
         helper.send_step('local', 6, f'完成\r\n{human_time()} 回滚发布...        跳过')
     else:
-        helper.local(f'cd {REPOS_DIR} && rm -rf {req.deploy_id}_*')
+        with helper.span('local', 'prepare'):
+            helper.local(f'cd {REPOS_DIR} && rm -rf {req.deploy_id}_*')
         helper.send_step('local', 1, '完成\r\n')
 
         if extend.hook_pre_server:
             helper.send_step('local', 2, f'{human_time()} 检出前任务...\r\n')
-            helper.local(f'cd /tmp && {extend.hook_pre_server}', env)
+            with helper.span('local', 'hook_pre_server'):
+                helper.local(f'cd /tmp && {extend.hook_pre_server}', env)
 
         helper.send_step('local', 3, f'{human_time()} 执行检出...        ')
         git_dir = os.path.join(REPOS_DIR, str(req.deploy.id))
         command = f'cd {git_dir} && git archive --prefix={env.SPUG_VERSION}/ {tree_ish} | (cd .. && tar xf -)'
-        helper.local(command)
+        with helper.span('local', 'checkout'):
+            helper.local(command)
         helper.send_step('local', 3, '完成\r\n')
 
         if extend.hook_post_server:
             helper.send_step('local', 4, f'{human_time()} 检出后任务...\r\n')
-            helper.local(f'cd {os.path.join(REPOS_DIR, env.SPUG_VERSION)} && {extend.hook_post_server}', env)
+            with helper.span('local', 'hook_post_server'):
+                helper.local(f'cd {os.path.join(REPOS_DIR, env.SPUG_VERSION)} && {extend.hook_post_server}', env)
 
         helper.send_step('local', 5, f'\r\n{human_time()} 执行打包...        ')
         filter_rule, exclude, contain = json.loads(extend.filter_rule), '', env.SPUG_VERSION
@@ -100,7 +110,9 @@ def _ext1_deploy(req, helper, env):
                 exclude = ' '.join(excludes)
             else:
                 contain = ' '.join(f'{env.SPUG_VERSION}/{x}' for x in files)
-        helper.local(f'cd {REPOS_DIR} && tar zcf {env.SPUG_VERSION}.tar.gz {exclude} {contain}')
+        with helper.span('local', 'package') as span:
+            helper.local(f'cd {REPOS_DIR} && tar zcf {env.SPUG_VERSION}.tar.gz {exclude} {contain}')
+            span['bytes'] = os.path.getsize(os.path.join(REPOS_DIR, f'{env.SPUG_VERSION}.tar.gz'))
         helper.send_step('local', 6, f'完成')
     threads, latest_exception = [], None
     with futures.ThreadPoolExecutor(max_workers=min(10, os.cpu_count() + 5)) as executor:
@@ -129,7 +141,8 @@ def _ext2_deploy(req, helper, env):
     step = 2
     for action in server_actions:
         helper.send_step('local', step, f'\r\n{human_time()} {action["title"]}...\r\n')
-        helper.local(f'cd /tmp && {action["data"]}', env)
+        with helper.span('local', action['title']):
+            helper.local(f'cd /tmp && {action["data"]}', env)
         step += 1
     helper.send_step('local', 100, '完成\r\n' if step == 2 else '\r\n')
 
@@ -160,7 +173,9 @@ def _ext2_deploy(req, helper, env):
                                 excludes.append(f'--exclude={x}')
                         exclude = ' '.join(excludes)
             tar_gz_file = f'{env.SPUG_VERSION}.tar.gz'
-            helper.local(f'cd {sp_dir} && tar zcf {tar_gz_file} {exclude} {contain}')
+            with helper.span('local', 'package') as span:
+                helper.local(f'cd {sp_dir} && tar zcf {tar_gz_file} {exclude} {contain}')
+                span['bytes'] = os.path.getsize(os.path.join(sp_dir, tar_gz_file))
             helper.send_info('local', '完成\r\n')
             tmp_transfer_file = os.path.join(sp_dir, tar_gz_file)
             break
@@ -194,22 +209,27 @@ def _deploy_ext1_host(helper, h_id, extend, env):
     env.update({'SPUG_HOST_ID': h_id, 'SPUG_HOST_NAME': host.hostname})
     ssh = host.get_ssh()
     if env.SPUG_DEPLOY_TYPE != '2':
-        code, _ = ssh.exec_command(
-            f'mkdir -p {extend.dst_repo} && [ -e {extend.dst_dir} ] && [ ! -L {extend.dst_dir} ]')
+        with helper.span(h_id, 'check'):
+            code, _ = ssh.exec_command(
+                f'mkdir -p {extend.dst_repo} && [ -e {extend.dst_dir} ] && [ ! -L {extend.dst_dir} ]')
         if code == 0:
             helper.send_error(host.id, f'检测到该主机的发布目录 {extend.dst_dir!r} 已存在，为了数据安全请自行备份后删除该目录，Spug 将会创建并接管该目录。')
         # clean
         clean_command = f'ls -d {extend.deploy_id}_* 2> /dev/null | sort -t _ -rnk2 | tail -n +{extend.versions + 1} | xargs rm -rf'
-        helper.remote(host.id, ssh, f'cd {extend.dst_repo} && rm -rf {env.SPUG_VERSION} && {clean_command}')
+        with helper.span(h_id, 'clean'):
+            helper.remote(host.id, ssh, f'cd {extend.dst_repo} && rm -rf {env.SPUG_VERSION} && {clean_command}')
         # transfer files
         tar_gz_file = f'{env.SPUG_VERSION}.tar.gz'
-        try:
-            ssh.put_file(os.path.join(REPOS_DIR, tar_gz_file), os.path.join(extend.dst_repo, tar_gz_file))
-        except Exception as e:
-            helper.send_error(host.id, f'exception: {e}')
+        with helper.span(h_id, 'transfer') as span:
+            try:
+                span['bytes'] = os.path.getsize(os.path.join(REPOS_DIR, tar_gz_file))
+                ssh.put_file(os.path.join(REPOS_DIR, tar_gz_file), os.path.join(extend.dst_repo, tar_gz_file))
+            except Exception as e:
+                helper.send_error(host.id, f'exception: {e}')
 
         command = f'cd {extend.dst_repo} && tar xf {tar_gz_file} && rm -f {env.SPUG_APP_ID}_*.tar.gz'
-        helper.remote(host.id, ssh, command)
+        with helper.span(h_id, 'extract'):
+            helper.remote(host.id, ssh, command)
     helper.send_step(h_id, 1, '完成\r\n')
 
     # pre host
@@ -217,18 +237,21 @@ def _deploy_ext1_host(helper, h_id, extend, env):
     if extend.hook_pre_host:
         helper.send_step(h_id, 2, f'{human_time()} 发布前任务...       \r\n')
         command = f'cd {repo_dir} && {extend.hook_pre_host}'
-        helper.remote(host.id, ssh, command, env)
+        with helper.span(h_id, 'hook_pre_host'):
+            helper.remote(host.id, ssh, command, env)
 
     # do deploy
     helper.send_step(h_id, 3, f'{human_time()} 执行发布...        ')
-    helper.remote(host.id, ssh, f'rm -f {extend.dst_dir} && ln -sfn {repo_dir} {extend.dst_dir}')
+    with helper.span(h_id, 'switch'):
+        helper.remote(host.id, ssh, f'rm -f {extend.dst_dir} && ln -sfn {repo_dir} {extend.dst_dir}')
     helper.send_step(h_id, 3, '完成\r\n')
 
     # post host
     if extend.hook_post_host:
         helper.send_step(h_id, 4, f'{human_time()} 发布后任务...       \r\n')
         command = f'cd {extend.dst_dir} && {extend.hook_post_host}'
-        helper.remote(host.id, ssh, command, env)
+        with helper.span(h_id, 'hook_post_host'):
+            helper.remote(host.id, ssh, command, env)
 
     helper.send_step(h_id, 5, f'\r\n{human_time()} ** 发布成功 **')
 
@@ -243,37 +266,87 @@ def _deploy_ext2_host(helper, h_id, actions, env):
     helper.send_step(h_id, 2, '完成\r\n')
     for index, action in enumerate(actions):
         helper.send_step(h_id, 2 + index, f'{human_time()} {action["title"]}...\r\n')
-        if action.get('type') == 'transfer':
-            if action.get('src_mode') == '1':
-                try:
-                    ssh.put_file(os.path.join(REPOS_DIR, env.SPUG_DEPLOY_ID, env.SPUG_VERSION), action['dst'])
-                except Exception as e:
-                    helper.send_error(host.id, f'exception: {e}')
-                helper.send_info(host.id, 'transfer completed\r\n')
-                continue
+        with helper.span(h_id, action['title']) as span:
+            if action.get('type') == 'transfer':
+                if action.get('src_mode') == '1':
+                    try:
+                        local_path = os.path.join(REPOS_DIR, env.SPUG_DEPLOY_ID, env.SPUG_VERSION)
+                        span['bytes'] = os.path.getsize(local_path)
+                        ssh.put_file(local_path, action['dst'])
+                    except Exception as e:
+                        helper.send_error(host.id, f'exception: {e}')
+                    helper.send_info(host.id, 'transfer completed\r\n')
+                    continue
+                else:
+                    sp_dir, sd_dst = os.path.split(action['src'])
+                    tar_gz_file = f'{env.SPUG_VERSION}.tar.gz'
+                    try:
+                        span['bytes'] = os.path.getsize(os.path.join(sp_dir, tar_gz_file))
+                        ssh.put_file(os.path.join(sp_dir, tar_gz_file), f'/tmp/{tar_gz_file}')
+                    except Exception as e:
+                        helper.send_error(host.id, f'exception: {e}')
+
+                    command = f'cd /tmp && tar xf {tar_gz_file} && rm -f {tar_gz_file} '
+                    command += f'&& rm -rf {action["dst"]} && mv /tmp/{sd_dst} {action["dst"]} && echo "transfer completed"'
             else:
-                sp_dir, sd_dst = os.path.split(action['src'])
-                tar_gz_file = f'{env.SPUG_VERSION}.tar.gz'
-                try:
-                    ssh.put_file(os.path.join(sp_dir, tar_gz_file), f'/tmp/{tar_gz_file}')
-                except Exception as e:
-                    helper.send_error(host.id, f'exception: {e}')
-
-                command = f'cd /tmp && tar xf {tar_gz_file} && rm -f {tar_gz_file} '
-                command += f'&& rm -rf {action["dst"]} && mv /tmp/{sd_dst} {action["dst"]} && echo "transfer completed"'
-        else:
-            command = f'cd /tmp && {action["data"]}'
-        helper.remote(host.id, ssh, command, env)
+                command = f'cd /tmp && {action["data"]}'
+            helper.remote(host.id, ssh, command, env)
 
     helper.send_step(h_id, 100, f'\r\n{human_time()} ** 发布成功 **')
 
 
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[max(0, -(-len(values) * percent // 100) - 1)]
+
+
+def aggregate_spans(reqs):
+    """
+    汇总多次发布的步骤耗时(毫秒)，本地步骤与主机步骤分开统计，
+    同一步骤在多台主机上的耗时都计入样本，同时返回每次发布的总耗时
+    """
+    steps, requests = {}, []
+    for req in reqs:
+        total = None
+        for span in json.loads(req.spans):
+            duration = round((span['end'] - span['start']) * 1000)
+            scope = 'local' if span['key'] == 'local' else 'host'
+            if scope == 'local' and span['name'] == 'total':
+                total = duration
+                continue
+            item = steps.setdefault((scope, span['name']), {'durations': [], 'bytes': [], 'failed': 0})
+            item['durations'].append(duration)
+            if span.get('bytes') is not None:
+                item['bytes'].append(span['bytes'])
+            if span['code'] != 0:
+                item['failed'] += 1
+        requests.append({'id': req.id, 'name': req.name, 'version': req.version, 'status': req.status,
+                         'do_at': req.do_at, 'duration': total})
+    result = []
+    for (scope, name), item in steps.items():
+        durations = item['durations']
+        result.append({
+            'scope': scope,
+            'name': name,
+            'count': len(durations),
+            'failed': item['failed'],
+            'p50': _percentile(durations, 50),
+            'p95': _percentile(durations, 95),
+            'max': max(durations),
+            'bytes': _percentile(item['bytes'], 50) if item['bytes'] else None,
+        })
+    return {'steps': result, 'requests': requests}
+
+
 class Helper:
     def __init__(self, rds, token, r_id):
         self.rds = rds
         self.token = token
-        self.log_key = f'{settings.REQUEST_KEY}:{r_id}'
-        self.rds.delete(self.log_key)
+        self.r_id = r_id
+        self.spans = []
+        self.spans_lock = Lock()
+        self.local_ctx = local()
+        logs.remove(r_id, rds)
 
     @classmethod
     def _make_dd_notify(cls, action, req, version, host_str):
@@ -405,13 +478,8 @@ class Helper:
                 data = cls._make_wx_notify(action, req, version, host_str)
             else:
                 raise NotImplementedError
-            res = requests.post(rst_notify['value'], json=data)
-            if res.status_code != 200:
-                Notify.make_notify('flag', '1', '发布通知发送失败', f'返回状态码：{res.status_code}, 请求URL：{res.url}')
-            if rst_notify['mode'] in ['1', '3']:
-                res = res.json()
-                if res.get('errcode') != 0:
-                    Notify.make_notify('flag', '1', '发布通知发送失败', f'返回数据：{res}')
+            mode = {'1': 'dd', '3': 'wx'}.get(rst_notify['mode'])
+            push(rst_notify['value'], data, 'flag', '发布通知发送失败', mode)
 
     def parse_filter_rule(self, data: str, sep='\n'):
         data, files = data.strip(), []
@@ -423,8 +491,11 @@ class Helper:
         return files
 
     def _send(self, message):
-        self.rds.lpush(self.token, json.dumps(message))
-        self.rds.lpush(self.log_key, json.dumps(message))
+        message = json.dumps(message)
+        with self.rds.pipeline(transaction=False) as pipe:
+            pipe.lpush(self.token, message)
+            logs.append(pipe, self.r_id, message)
+            pipe.execute()
 
     def send_info(self, key, message):
         self._send({'key': key, 'status': 'info', 'data': message})
@@ -438,6 +509,33 @@ class Helper:
     def send_step(self, key, step, data):
         self._send({'key': key, 'step': step, 'data': data})
 
+    @contextmanager
+    def span(self, key, name):
+        """
+        记录一个发布步骤的耗时，local/remote 执行的命令的退出码记录到当前步骤，
+        可在 with 块内设置 bytes 记录传输的字节数
+        """
+        span = {'key': str(key), 'name': name, 'start': round(time.time(), 3), 'code': None}
+        parent, self.local_ctx.span = getattr(self.local_ctx, 'span', None), span
+        try:
+            yield span
+            if span['code'] is None:
+                span['code'] = 0
+        except Exception:
+            if span['code'] in (None, 0):
+                span['code'] = -1
+            raise
+        finally:
+            self.local_ctx.span = parent
+            span['end'] = round(time.time(), 3)
+            with self.spans_lock:
+                self.spans.append(span)
+
+    def _set_code(self, code):
+        span = getattr(self.local_ctx, 'span', None)
+        if span is not None:
+            span['code'] = code
+
     def local(self, command, env=None):
         if env:
             env = dict(env.items())
@@ -449,12 +547,14 @@ class Helper:
             if not message:
                 break
             self.send_info('local', message.decode())
-        if task.wait() != 0:
+        self._set_code(task.wait())
+        if task.returncode != 0:
             self.send_error('local', f'exit code: {task.returncode}')
 
     def remote(self, key, ssh, command, env=None):
         code = -1
         for code, out in ssh.exec_command_with_stream(command, environment=env):
             self.send_info(key, out)
+        self._set_code(code)
         if code != 0:
             self.send_error(key, f'exit code: {code}')
@@ -3,17 +3,20 @@
 # Released under the AGPL-3.0 License.
 from django.views.generic import View
 from django.db.models import F
+from django.db import transaction
 from django.conf import settings
-from django.http.response import HttpResponseBadRequest
-from django_redis import get_redis_connection
+from django.http.response import HttpResponseBadRequest, StreamingHttpResponse
 from libs import json_response, JsonParser, Argument, human_datetime, human_time
 from apps.deploy.models import DeployRequest
 from apps.app.models import Deploy, DeployExtend2
-from apps.deploy.utils import deploy_dispatch, Helper
+from apps.deploy.utils import Helper, aggregate_spans
+from apps.deploy.worker import enqueue, queue_info, queue_length
+from apps.deploy import logs
 from apps.host.models import Host
 from collections import defaultdict
 from threading import Thread
 from datetime import datetime
+from itertools import islice
 import subprocess
 import json
 import uuid
@@ -27,7 +30,7 @@ class RequestView(View):
             perms = request.user.deploy_perms
             query['deploy__app_id__in'] = perms['apps']
             query['deploy__env_id__in'] = perms['envs']
-        for item in DeployRequest.objects.filter(**query).annotate(
+        for item in DeployRequest.objects.filter(**query).defer('spans').annotate(
                 env_id=F('deploy__env_id'),
                 env_name=F('deploy__env__name'),
                 app_id=F('deploy__app_id'),
@@ -35,7 +38,7 @@ class RequestView(View):
                 app_host_ids=F('deploy__host_ids'),
                 app_extend=F('deploy__extend'),
                 created_by_user=F('created_by__nickname')):
-            tmp = item.to_dict()
+            tmp = item.to_dict(excludes=('spans',))
             tmp['env_id'] = item.env_id
             tmp['env_name'] = item.env_name
             tmp['app_id'] = item.app_id
@@ -143,9 +146,14 @@ class RequestView(View):
                     else:
                         counter[item.deploy_id] += 1
                 count, _ = DeployRequest.objects.filter(id__in=ids).delete()
+                for r_id in ids:
+                    logs.remove(r_id)
                 return json_response(count)
             elif form.expire:
-                count, _ = DeployRequest.objects.filter(created_at__lt=form.expire).delete()
+                ids = list(DeployRequest.objects.filter(created_at__lt=form.expire).values_list('id', flat=True))
+                count, _ = DeployRequest.objects.filter(id__in=ids).delete()
+                for r_id in ids:
+                    logs.remove(r_id)
                 return json_response(count)
             else:
                 return json_response(error='请至少使用一个删除条件')
@@ -154,22 +162,30 @@ class RequestView(View):
 
 class RequestDetailView(View):
     def get(self, request, r_id):
+        form, error = JsonParser(
+            Argument('log', required=False),
+            Argument('format', filter=lambda x: x in ('json', 'ndjson'), default='json', help='参数错误'),
+            Argument('hosts', handler=lambda x: x.split(','), required=False),
+            Argument('offset', type=int, default=0, filter=lambda x: x >= 0, help='参数错误'),
+            Argument('limit', type=int, required=False, filter=lambda x: x > 0, help='参数错误'),
+        ).parse(request.GET)
+        if error is not None:
+            return json_response(error=error)
         req = DeployRequest.objects.filter(pk=r_id).first()
         if not req:
             return json_response(error='未找到指定发布申请')
+        if form.format == 'ndjson':
+            # 逐行流式返回日志，每行为一条json消息，浏览器可边接收边渲染
+            return StreamingHttpResponse((f'{x}\n' for x in self._read_logs(req, form)),
+                                         content_type='application/x-ndjson')
         hosts = Host.objects.filter(id__in=json.loads(req.host_ids))
         targets = [{'id': x.id, 'title': f'{x.name}({x.hostname}:{x.port})'} for x in hosts]
         server_actions, host_actions, outputs = [], [], []
         if req.deploy.extend == '2':
             server_actions = json.loads(req.deploy.extend_obj.server_actions)
             host_actions = json.loads(req.deploy.extend_obj.host_actions)
-        if request.GET.get('log'):
-            rds, key, counter = get_redis_connection(), f'{settings.REQUEST_KEY}:{r_id}', 0
-            data = rds.lrange(key, counter, counter + 9)
-            while data:
-                counter += 10
-                outputs.extend(x.decode() for x in data)
-                data = rds.lrange(key, counter, counter + 9)
+        if form.log:
+            outputs = list(self._read_logs(req, form))
         return json_response({
             'app_name': req.deploy.app.name,
             'env_name': req.deploy.env.name,
@@ -179,9 +195,17 @@ class RequestDetailView(View):
             'targets': targets,
             'server_actions': server_actions,
             'host_actions': host_actions,
+            'spans': json.loads(req.spans) if req.spans else [],
             'outputs': outputs
         })
 
+    def _read_logs(self, req, form):
+        if req.status != '2':
+            # 归档升级前或异常中断的发布遗留在Redis中的日志
+            logs.compact(req.id)
+        stop = form.offset + form.limit if form.limit else None
+        return islice(logs.read(req.id, form.hosts), form.offset, stop)
+
     def post(self, request, r_id):
         query = {'pk': r_id}
         if not request.user.is_supper:
@@ -203,7 +227,10 @@ class RequestDetailView(View):
         if not req.version:
             req.version = f'{req.deploy_id}_{req.id}_{datetime.now().strftime("%Y%m%d%H%M%S")}'
         req.save()
-        Thread(target=deploy_dispatch, args=(request, req, token)).start()
+        if queue_length():
+            outputs['local']['data'].insert(0, f'{human_time()} 等待发布队列...\r\n')
+        # 事务提交后再入队，避免工作进程读取到未提交的发布状态
+        transaction.on_commit(lambda: enqueue(req, token))
         return json_response({'token': token, 'type': req.type, 'outputs': outputs})
 
     def patch(self, request, r_id):
@@ -228,6 +255,33 @@ class RequestDetailView(View):
         return json_response(error=error)
 
 
+def get_spans(request):
+    """
+    统计应用最近若干次发布中各步骤耗时的p50/p95，用于发现发布耗时的变化
+    """
+    form, error = JsonParser(
+        Argument('app_id', type=int, help='请指定应用'),
+        Argument('env_id', type=int, required=False),
+        Argument('limit', type=int, default=20, filter=lambda x: 0 < x <= 200, help='统计数量需在1到200之间'),
+    ).parse(request.GET)
+    if error is None:
+        query = {'deploy__app_id': form.app_id, 'spans__isnull': False}
+        if form.env_id:
+            query['deploy__env_id'] = form.env_id
+        if not request.user.is_supper:
+            perms = request.user.deploy_perms
+            if form.app_id not in perms['apps']:
+                return json_response(error='无权访问该应用，请联系管理员')
+            query['deploy__env_id__in'] = perms['envs']
+        reqs = DeployRequest.objects.filter(**query).only('id', 'name', 'version', 'status', 'do_at', 'spans')
+        return json_response(aggregate_spans(reqs[:form.limit]))
+    return json_response(error=error)
+
+
+def get_queue(request):
+    return json_response(queue_info())
+
+
 def do_upload(request):
     repos_dir = settings.REPOS_DIR
     file = request.FILES['file']
@@ -0,0 +1,187 @@
+# Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
+# Copyright: (c) <spug.dev@gmail.com>
+# Released under the AGPL-3.0 License.
+from django_redis import get_redis_connection
+from django.db import close_old_connections, connections
+from django.conf import settings
+from apps.deploy.models import DeployRequest
+from apps.deploy.utils import deploy_dispatch
+from apps.deploy import logs
+from libs import human_time
+from multiprocessing import Process
+from threading import Thread, Event
+import logging
+import signal
+import socket
+import json
+import time
+import os
+
+logger = logging.getLogger('django.apps.deployer')
+
+QUEUE_KEY = settings.DEPLOY_KEY
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TTL = 30
+
+
+def _processing_key(name):
+    return f'{QUEUE_KEY}:processing:{name}'
+
+
+def _alive_key(name):
+    return f'{QUEUE_KEY}:alive:{name}'
+
+
+def _lock_key(app_id):
+    return f'{QUEUE_KEY}:lock:{app_id}'
+
+
+def enqueue(req, token):
+    """
+    将发布任务加入队列，工作进程仅执行状态为发布中的申请，需在申请状态提交后调用
+    """
+    rds = get_redis_connection()
+    rds.lpush(QUEUE_KEY, json.dumps({'id': req.id, 'app_id': req.deploy.app_id, 'token': token}))
+
+
+def queue_length():
+    return get_redis_connection().llen(QUEUE_KEY)
+
+
+def queue_info():
+    rds = get_redis_connection()
+    pending = [json.loads(x)['id'] for x in reversed(rds.lrange(QUEUE_KEY, 0, -1))]
+    running = []
+    for key in rds.scan_iter(_processing_key('*')):
+        running.extend(json.loads(x)['id'] for x in rds.lrange(key, 0, -1))
+    workers = len(list(rds.scan_iter(_alive_key('*'))))
+    return {'pending': pending, 'running': running, 'workers': workers}
+
+
+def recover(rds):
+    """
+    处理已退出的工作进程遗留的任务：执行中断的发布标记为发布异常，由用户确认后重新发布
+    """
+    for key in rds.scan_iter(_processing_key('*')):
+        name = key.decode().rsplit(':', 1)[-1]
+        if rds.exists(_alive_key(name)):
+            continue
+        for data in rds.lrange(key, 0, -1):
+            job = json.loads(data)
+            if DeployRequest.objects.filter(pk=job['id'], status='2').update(status='-3'):
+                logger.warning(f'deploy request {job["id"]} interrupted by worker {name}')
+                message = json.dumps({'key': 'local', 'status': 'error',
+                                      'data': f'\r\n{human_time()} 发布进程异常退出，请检查后重新发布'})
+                rds.lpush(job['token'], message)
+                rds.expire(job['token'], 5 * 60)
+                logs.append(rds, job['id'], message)
+                logs.compact(job['id'], rds)
+        rds.delete(key)
+
+
+class Worker:
+    """
+    从队列中领取发布任务并执行，同一应用同时只允许一个发布任务，
+    领取的任务在执行结束前保存在该进程专属的处理中队列，进程异常退出后由 recover 处理
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.rds = get_redis_connection()
+        self.processing = _processing_key(name)
+        self.locks = set()
+        self.stopped = Event()
+
+    def _beat(self):
+        with self.rds.pipeline(transaction=False) as pipe:
+            pipe.setex(_alive_key(self.name), HEARTBEAT_TTL, os.getpid())
+            for app_id in list(self.locks):
+                pipe.expire(_lock_key(app_id), HEARTBEAT_TTL)
+            pipe.execute()
+
+    def _heartbeat(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            self._beat()
+
+    def _requeue(self, data):
+        with self.rds.pipeline() as pipe:
+            pipe.lpush(QUEUE_KEY, data)
+            pipe.lrem(self.processing, 1, data)
+            pipe.execute()
+
+    def _execute(self, job):
+        close_old_connections()
+        req = DeployRequest.objects.filter(pk=job['id']).select_related('deploy').first()
+        if req and req.status == '2':
+            try:
+                deploy_dispatch(req, job['token'])
+            except Exception as e:
+                logger.exception(f'deploy request {req.id} failed: {e}')
+        else:
+            logger.warning(f'deploy request {job["id"]} skipped, status: {req.status if req else None}')
+            message = json.dumps({'key': 'local', 'status': 'error',
+                                  'data': f'\r\n{human_time()} 发布申请不存在或状态异常，已跳过'})
+            self.rds.lpush(job['token'], message)
+            self.rds.expire(job['token'], 5 * 60)
+
+    def run(self):
+        self._beat()
+        Thread(target=self._heartbeat, daemon=True).start()
+        logger.info(f'Running deploy worker {self.name}')
+        while True:
+            data = self.rds.brpoplpush(QUEUE_KEY, self.processing, timeout=5)
+            if not data:
+                continue
+            job = json.loads(data)
+            lock = _lock_key(job['app_id'])
+            if not self.rds.set(lock, self.name, nx=True, ex=HEARTBEAT_TTL):
+                # 该应用正在发布，放回队尾稍后重试
+                self._requeue(data)
+                time.sleep(1)
+                continue
+            self.locks.add(job['app_id'])
+            try:
+                self._execute(job)
+            finally:
+                self.locks.discard(job['app_id'])
+                self.rds.delete(lock)
+                self.rds.lrem(self.processing, 1, data)
+
+
+def _worker_main():
+    # 不继承主进程的信号处理，收到信号直接退出，遗留的任务由 recover 处理
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    Worker(f'{socket.gethostname()}-{os.getpid()}').run()
+
+
+def _start_worker():
+    connections.close_all()
+    process = Process(target=_worker_main, daemon=True)
+    process.start()
+    return process
+
+
+def run(workers):
+    logger.info(f'Running deployer with {workers} workers')
+    rds = get_redis_connection()
+    processes = [_start_worker() for _ in range(workers)]
+
+    def stop(signum, frame):
+        logger.info(f'Received signal {signum}, stopping deploy workers')
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(HEARTBEAT_INTERVAL)
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while True:
+        for index, process in enumerate(processes):
+            if not process.is_alive():
+                logger.warning(f'deploy worker {process.pid} exited with code {process.exitcode}, restarting')
+                processes[index] = _start_worker()
+        close_old_connections()
+        recover(rds)
+        time.sleep(HEARTBEAT_INTERVAL)
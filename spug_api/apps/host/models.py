@@ -1,8 +1,6 @@
 # Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
 # Copyright: (c) <spug.dev@gmail.com>
 # Released under the AGPL-3.0 License.
-import queue
-
 from django.db import models
 from libs import ModelMixin, human_datetime
 from apps.account.models import User
@@ -13,8 +11,15 @@ from libs.ssh import SSH
 class Category(models.Model, ModelMixin):
     name = models.CharField(max_length=50)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True, related_name='children')
+    # 物化路径，由根到自身的 id 组成，例如 /1/5/12/，用于一次查询子树
+    path = models.CharField(max_length=255, default='', db_index=True)
+    full_path = models.CharField(max_length=512, default='')
+
+    _paths_checked = False
 
     def __str__(self):
+        if self.full_path:
+            return self.full_path
         full_path = [self.name]
         k = self.parent
         while k is not None:
@@ -22,7 +27,53 @@ class Category(models.Model, ModelMixin):
             k = k.parent
         return '/'.join(full_path[::-1])
 
-    def tree(self, filter_empty=True, visited={}):
+    @classmethod
+    def check_paths(cls):
+        """
+        补全升级前创建的类别的物化路径，每个进程仅检查一次
+        """
+        if not cls._paths_checked:
+            if cls.objects.filter(path='').exists():
+                cls.rebuild_paths()
+            cls._paths_checked = True
+
+    @classmethod
+    def rebuild_paths(cls):
+        categories = {x.id: x for x in cls.objects.all()}
+
+        def build(category):
+            if not category.path:
+                parent = categories.get(category.parent_id)
+                if parent:
+                    build(parent)
+                    category.path = f'{parent.path}{category.id}/'
+                    category.full_path = f'{parent.full_path}/{category.name}'
+                else:
+                    category.path = f'/{category.id}/'
+                    category.full_path = category.name
+
+        for category in categories.values():
+            category.path = ''
+        for category in categories.values():
+            build(category)
+        cls.objects.bulk_update(categories.values(), ['path', 'full_path'], batch_size=500)
+
+    @classmethod
+    def snapshot(cls):
+        """
+        一次性加载全部类别及各类别下未删除的主机数量，
+        返回 (id到类别的映射, 父id到子类别列表的映射, id到主机数量的映射)
+        """
+        cls.check_paths()
+        categories, children = {}, {}
+        for category in cls.objects.all():
+            categories[category.id] = category
+            children.setdefault(category.parent_id, []).append(category)
+        counts = dict(Host.objects.filter(deleted_by_id__isnull=True, category_id__isnull=False)
+                      .values_list('category_id').annotate(count=models.Count('id')))
+        return categories, children, counts
+
+    def tree(self, filter_empty=True, visited=None, snapshot=None):
         """
         将自身结构表达为可被 https://ant.design/components/cascader-cn/ 组件
         的 options 接受的格式
@@ -30,22 +81,23 @@ class Category(models.Model, ModelMixin):
         Args:
             filter_empty: 是否过滤没有所属 host 的 Category，默认过滤
             visited: 缓存每个子节点的结构，以 id 为 key
+            snapshot: Category.snapshot() 的返回值，未指定时自动加载
         """
+        visited = {} if visited is None else visited
         if self.id in visited:
             return visited[self.id]
+        snapshot = snapshot or self.snapshot()
+        _, children, counts = snapshot
 
         res = {
             'value': self.name,
             'label': self.name,
         }
 
-        childrens = self.children.all()
+        childrens = children.get(self.id, [])
 
         if len(childrens) == 0:
-            if (
-                filter_empty
-                and self.host_set.filter(deleted_by_id__isnull=True).count() == 0
-            ):
+            if filter_empty and counts.get(self.id, 0) == 0:
                 visited[self.id] = None
             else:
                 visited[self.id] = res
@@ -53,7 +105,7 @@ class Category(models.Model, ModelMixin):
 
         res['children'] = []
         for c in childrens:
-            sub_tree = c.tree(filter_empty, visited)
+            sub_tree = c.tree(filter_empty, visited, snapshot)
             if (
                 not filter_empty
                 or sub_tree is not None
@@ -63,7 +115,7 @@ class Category(models.Model, ModelMixin):
         if len(res['children']) > 0:
             visited[self.id] = res
         else:
-            if self.host_set.filter(deleted_by_id__isnull=True).count() > 0:
+            if counts.get(self.id, 0) > 0:
                 del res['children']
                 visited[self.id] = res
             else:
@@ -71,10 +123,11 @@ class Category(models.Model, ModelMixin):
         return visited[self.id]
 
     @classmethod
-    def forest(cls):
-        res = []
-        for category in cls.objects.filter(parent=None).all():
-            tree = category.tree()
+    def forest(cls, snapshot=None):
+        snapshot = snapshot or cls.snapshot()
+        res, visited = [], {}
+        for category in snapshot[1].get(None, []):
+            tree = category.tree(visited=visited, snapshot=snapshot)
             if tree is not None:
                 res.append(tree)
         return res
@@ -90,22 +143,24 @@ class Category(models.Model, ModelMixin):
             current: 最低层次的类别
             generated: 是否有新生成的类别
         """
+        cls.check_paths()
         parent = None
         current = None
         generated = False
         for name in location.split('/'):
             current, created = cls.objects.get_or_create(name=name, parent=parent)
+            if created:
+                current.path = f'{parent.path if parent else "/"}{current.id}/'
+                current.full_path = f'{parent.full_path}/{name}' if parent else name
+                current.save(update_fields=('path', 'full_path'))
             parent = current
             generated = generated or created
         return current, generated
 
     @classmethod
-    def zones(cls):
-        res = []
-        for category in cls.objects.all():
-            if category.host_set.filter(deleted_by_id__isnull=True).count() > 0:
-                res.append(str(category))
-        return res
+    def zones(cls, snapshot=None):
+        categories, _, counts = snapshot or cls.snapshot()
+        return [str(x) for x in categories.values() if counts.get(x.id, 0) > 0]
 
     @classmethod
     def sub_zones(cls, categories):
@@ -127,73 +182,57 @@ class Category(models.Model, ModelMixin):
 
     @classmethod
     def hosts(cls, category_pks):
-        hosts = []
-        pks = queue.Queue()
-        visited = set()
-        for pk in category_pks:
-            pks.put(pk)
-        while not pks.empty():
-            pk = pks.get()
-            if pk in visited:
-                continue
-            category = cls.objects.get(pk=pk)
-            for host in category.host_set.filter(deleted_by_id__isnull=True).all():
-                hosts.append(host)
-            for c in category.children.all():
-                pks.put(c.id)
-            visited.add(pk)
-        return hosts
+        """
+        返回指定类别及其所有子类别下未删除的主机
+        """
+        cls.check_paths()
+        paths = cls.objects.filter(pk__in=category_pks).values_list('path', flat=True)
+        query = models.Q()
+        for path in paths:
+            query |= models.Q(category__path__startswith=path)
+        if not query:
+            return Host.objects.none()
+        return Host.objects.filter(query, deleted_by_id__isnull=True)
 
     @classmethod
-    def sub_forest(cls, category_pks):
+    def sub_forest(cls, category_pks, snapshot=None):
+        snapshot = snapshot or cls.snapshot()
+        categories = snapshot[0]
         visited = {}
         for pk in category_pks:
-            if pk in visited:
+            if pk in visited or pk not in categories:
                 continue
-            category = cls.objects.get(pk=pk)
-            category.tree(visited=visited)
+            categories[pk].tree(visited=visited, snapshot=snapshot)
 
-        root = set()
+        root = []
+        attached = set()
         parent_visited = {}
-        for pk, tree in visited.items():
-            category = cls.objects.get(pk=pk)
-            while category.parent:
-                parent = category.parent
-                if parent.id in visited:
-                    category = parent
-                    continue
-
-                if category.id in visited:
-                    tree = visited[category.id]
-                elif category.id in parent_visited:
-                    tree = parent_visited[category.id]
-                else:
-                    raise KeyError(f'{category.id} not visited')
+        for pk in visited:
+            # 定位到该节点所在的最上层子树，每棵子树只挂载一次
+            category = categories[pk]
+            while category.parent_id in visited:
+                category = categories[category.parent_id]
+            if category.id in attached or visited[category.id] is None:
+                continue
+            attached.add(category.id)
 
+            tree = visited[category.id]
+            while category.parent_id:
+                parent = categories[category.parent_id]
                 if parent.id in parent_visited:
                     parent_visited[parent.id]['children'].append(tree)
-                else:
-                    parent_visited[parent.id] = {
-                        'value': parent.name,
-                        'label': parent.name,
-                        'children': [tree],
-                    }
-
+                    break
+                parent_visited[parent.id] = {
+                    'value': parent.name,
+                    'label': parent.name,
+                    'children': [tree],
+                }
+                tree = parent_visited[parent.id]
                 category = parent
             else:
-                root.add(category.id)
-
-        trees = []
-        for pk in root:
-            if pk in visited:
-                tree = visited[pk]
-            elif pk in parent_visited:
-                tree = parent_visited[pk]
-            else:
-                raise KeyError(f'{pk} not visited')
-            trees.append(tree)
+                root.append(tree)
 
-        return trees
+        return root
 
 
 class Tag(models.Model, ModelMixin):
@@ -265,3 +304,23 @@ class Host(models.Model, ModelMixin):
     class Meta:
         db_table = 'hosts'
         ordering = ('-id',)
+
+
+class HostFacts(models.Model, ModelMixin):
+    host = models.OneToOneField(Host, on_delete=models.CASCADE, primary_key=True, related_name='facts')
+    os = models.CharField(max_length=100, default='')
+    kernel = models.CharField(max_length=100, default='')
+    arch = models.CharField(max_length=20, default='')
+    cpu = models.SmallIntegerField(null=True)
+    memory = models.IntegerField(null=True)  # MB
+    disk = models.IntegerField(null=True)  # 根分区，GB
+    digest = models.CharField(max_length=32, default='')
+    error = models.CharField(max_length=255, null=True)
+    checked_at = models.IntegerField(default=0, db_index=True)
+    updated_at = models.CharField(max_length=20, null=True)
+
+    def __repr__(self):
+        return '<HostFacts host_id=%r>' % self.host_id
+
+    class Meta:
+        db_table = 'host_facts'
@@ -3,10 +3,12 @@
 # Released under the AGPL-3.0 License.
 from django.urls import path
 
-from .views import HostView, post_import, get_categories, post_parse
+from .views import HostView, get_hosts, post_facts, post_import, get_categories, post_parse
 
 urlpatterns = [
     path('', HostView.as_view()),
+    path('list/', get_hosts),
+    path('facts/', post_facts),
     path('import/', post_import),
     path('parse/', post_parse),
     path('category/', get_categories),
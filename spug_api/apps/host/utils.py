@@ -0,0 +1,242 @@
+# Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
+# Copyright: (c) <spug.dev@gmail.com>
+# Released under the AGPL-3.0 License.
+from django_redis import get_redis_connection
+from django.db import models, connection, close_old_connections, transaction
+from django.conf import settings
+from apps.setting.utils import AppSetting
+from apps.host.models import Host, Tag, Category, HostFacts
+from libs.ssh import SSH, AuthenticationException
+from paramiko.ssh_exception import BadAuthenticationType
+from libs import human_datetime
+from concurrent import futures
+import hashlib
+import socket
+import json
+import time
+
+# 批量导入时并发验证SSH连接的数量
+IMPORT_CONCURRENCY = 20
+# 采集主机信息时并发连接的数量
+FACTS_CONCURRENCY = 20
+FACTS_FIELDS = ('os', 'kernel', 'arch', 'cpu', 'memory', 'disk')
+FACTS_COMMAND = r'''
+[ -f /etc/os-release ] && . /etc/os-release || true
+echo "os=${PRETTY_NAME:-$(uname -s)}"
+echo "kernel=$(uname -r)"
+echo "arch=$(uname -m)"
+echo "cpu=$(nproc 2>/dev/null || grep -c ^processor /proc/cpuinfo)"
+echo "memory=$(awk '/^MemTotal/{print int($2/1024)}' /proc/meminfo)"
+echo "disk=$(df -Pk / | awk 'NR==2{print int($2/1048576)}')"
+'''
+
+
+def get_ssh_keys():
+    try:
+        private_key = AppSetting.get('private_key')
+        public_key = AppSetting.get('public_key')
+    except KeyError:
+        private_key, public_key = SSH.generate_key()
+        AppSetting.set('private_key', private_key, 'ssh private key')
+        AppSetting.set('public_key', public_key, 'ssh public key')
+    return private_key, public_key
+
+
+def valid_ssh(hostname, port, username, password=None, pkey=None, with_expect=True):
+    private_key, public_key = get_ssh_keys()
+    if password:
+        _cli = SSH(hostname, port, username, password=str(password))
+        _cli.add_public_key(public_key)
+    if pkey:
+        private_key = pkey
+    try:
+        cli = SSH(hostname, port, username, private_key)
+        cli.ping()
+    except BadAuthenticationType:
+        if with_expect:
+            raise TypeError('该主机不支持密钥认证，请参考官方文档，错误代码：E01')
+        return False
+    except AuthenticationException:
+        if password and with_expect:
+            raise ValueError('密钥认证失败，请参考官方文档，错误代码：E02')
+        return False
+    return True
+
+
+def _check_row(row, password):
+    try:
+        if valid_ssh(row.hostname, row.port, row.username, row.password or password, None, False) is False:
+            return 'fail'
+    except AuthenticationException:
+        return 'fail'
+    except socket.error:
+        return 'network'
+    except Exception:
+        return 'error'
+    return 'success'
+
+
+class HostImporter:
+    """
+    后台导入主机，并发验证SSH连接后批量写入，进度及结果通过 token 推送至websocket
+    """
+
+    def __init__(self, user, rows, password, summary, token):
+        self.user = user
+        self.rows = rows
+        self.password = password
+        self.summary = summary
+        self.token = token
+        self.rds = get_redis_connection()
+
+    def _send(self, message, with_expire=False):
+        self.rds.lpush(self.token, json.dumps(message))
+        if with_expire:
+            self.rds.expire(self.token, 300)
+
+    def run(self):
+        try:
+            self._run()
+            self._send({'type': 'summary', 'data': self.summary}, True)
+        except Exception as e:
+            self._send({'type': 'error', 'data': f'{e}'}, True)
+        finally:
+            connection.close()
+
+    def _run(self):
+        hosts = Host.objects.filter(deleted_by_id__isnull=True)
+        exists = set(hosts.values_list('hostname', 'port', 'username'))
+        names = set(hosts.values_list('name', flat=True))
+        pending = []
+        for i, row in self.rows:
+            key = (row.hostname, row.port, row.username)
+            if key in exists:
+                self.summary['skip'].append(i)
+            else:
+                exists.add(key)
+                pending.append((i, row))
+
+        # 预先加载密钥，验证线程中不再访问数据库
+        get_ssh_keys()
+        results, total = {}, len(pending)
+        self._send({'type': 'progress', 'done': 0, 'total': total})
+        with futures.ThreadPoolExecutor(max_workers=IMPORT_CONCURRENCY) as executor:
+            tasks = {executor.submit(_check_row, row, self.password): i for i, row in pending}
+            for future in futures.as_completed(tasks):
+                results[tasks[future]] = future.result()
+                self._send({'type': 'progress', 'done': len(results), 'total': total})
+
+        rows = []
+        for i, row in pending:
+            status = results[i]
+            if status == 'success':
+                if row.name in names:
+                    status = 'repeat'
+                else:
+                    names.add(row.name)
+                    rows.append(row)
+            self.summary[status].append(i)
+        if rows:
+            self._save(rows)
+
+    @transaction.atomic
+    def _save(self, rows):
+        categories, generated_ids = {}, []
+        for name in set(x.category for x in rows):
+            category, generated = Category.generate(name)
+            categories[name] = category.id
+            if generated:
+                generated_ids.append(category.id)
+
+        # bulk_create 在MySQL下不会回填主键，在同一事务中逐条创建以取得准确的主机ID
+        host_tags = {}
+        for x in rows:
+            host = Host.objects.create(
+                name=x.name,
+                hostname=x.hostname,
+                port=x.port,
+                username=x.username,
+                desc=x.desc,
+                category_id=categories[x.category],
+                created_by=self.user
+            )
+            host_tags[host.id] = set(t.strip() for t in str(x.tags).split(',') if t.strip())
+        tag_names = set().union(*host_tags.values())
+        tags = dict(Tag.objects.filter(name__in=tag_names).values_list('name', 'id'))
+        Tag.objects.bulk_create([Tag(name=x) for x in tag_names if x not in tags])
+        tags = dict(Tag.objects.filter(name__in=tag_names).values_list('name', 'id'))
+        Host.tags.through.objects.bulk_create([
+            Host.tags.through(host_id=h_id, tag_id=tags[name]) for h_id, names in host_tags.items() for name in names
+        ], batch_size=500)
+
+        if self.user.role:
+            self.user.role.add_host_perm(*host_tags.keys())
+            for category_id in generated_ids:
+                self.user.role.add_category_perms(category_id)
+
+
+def _parse_facts(out):
+    facts = {}
+    for line in out.splitlines():
+        key, _, value = line.partition('=')
+        if key in FACTS_FIELDS:
+            facts[key] = value.strip()
+    for key in ('cpu', 'memory', 'disk'):
+        facts[key] = int(facts[key]) if facts.get(key, '').isdigit() else None
+    for key in ('os', 'kernel', 'arch'):
+        facts[key] = facts.get(key, '')[:HostFacts._meta.get_field(key).max_length]
+    return facts
+
+
+def _fetch_facts(host, private_key):
+    try:
+        code, out = host.get_ssh(host.pkey or private_key).exec_command(FACTS_COMMAND, timeout=30)
+        if code != 0:
+            return None, f'exit code {code}: {out[-200:]}'
+        return _parse_facts(out), None
+    except Exception as e:
+        return None, f'{e}'[:255]
+
+
+def collect_facts(hosts=None, limit=None):
+    """
+    并发采集主机的系统信息，默认按上次采集时间从早到晚选取超过 HOST_FACTS_MAX_AGE 未采集的主机，
+    内容摘要未变化的主机仅更新采集时间，返回 (已变化, 未变化, 失败) 的数量
+    """
+    now = int(time.time())
+    if hosts is None:
+        hosts = Host.objects.filter(deleted_by_id__isnull=True).exclude(
+            facts__checked_at__gte=now - settings.HOST_FACTS_MAX_AGE
+        ).order_by(models.F('facts__checked_at').asc(nulls_first=True))[:limit or settings.HOST_FACTS_BATCH]
+    hosts = list(hosts)
+    if not hosts:
+        return 0, 0, 0
+    digests = dict(HostFacts.objects.filter(host_id__in=[x.id for x in hosts]).values_list('host_id', 'digest'))
+    private_key, _ = get_ssh_keys()
+
+    changed, unchanged, failed = [], [], {}
+    with futures.ThreadPoolExecutor(max_workers=FACTS_CONCURRENCY) as executor:
+        tasks = {executor.submit(_fetch_facts, host, private_key): host for host in hosts}
+        for future in futures.as_completed(tasks):
+            host, (facts, error) = tasks[future], future.result()
+            if error:
+                failed[host.id] = error
+                continue
+            digest = hashlib.md5(json.dumps(facts, sort_keys=True).encode()).hexdigest()
+            if digests.get(host.id) == digest:
+                unchanged.append(host.id)
+            else:
+                changed.append(HostFacts(host_id=host.id, digest=digest, checked_at=now,
+                                         updated_at=human_datetime(), **facts))
+
+    HostFacts.objects.filter(host_id__in=unchanged).update(checked_at=now, error=None)
+    for host_id, error in failed.items():
+        HostFacts.objects.update_or_create(host_id=host_id, defaults={'checked_at': now, 'error': error})
+    for facts in changed:
+        facts.save()
+    return len(changed), len(unchanged), len(failed)
+
+
+def auto_refresh_facts():
+    close_old_connections()
+    collect_facts()
@@ -2,20 +2,28 @@
 # Copyright: (c) <spug.dev@gmail.com>
 # Released under the AGPL-3.0 License.
 from django.views.generic import View
-from django.db.models import F
+from django.db.models import F, Q, Count
 from django.http.response import HttpResponseBadRequest
 from libs import json_response, JsonParser, Argument
-from apps.setting.utils import AppSetting
-from apps.host.models import Host, Tag, Category
+from apps.host.models import Host, Tag, Category, HostFacts
+from apps.host.utils import valid_ssh, HostImporter, collect_facts
 from apps.app.models import Deploy
 from apps.schedule.models import Task
 from apps.monitor.models import Detection
 from apps.account.models import Role
-from libs.ssh import SSH, AuthenticationException
-from paramiko.ssh_exception import BadAuthenticationType
 from libs import human_datetime, AttrDict
+from libs.channel import Channel
 from openpyxl import load_workbook
-import socket
+from threading import Thread
+
+
+# 允许排序的系统信息字段
+FACTS_SORTS = {
+    'cpu': 'facts__cpu',
+    'memory': 'facts__memory',
+    'disk': 'facts__disk',
+    'checked_at': 'facts__checked_at',
+}
 
 
 class HostView(View):
@@ -25,15 +33,17 @@ class HostView(View):
             if not request.user.has_host_perm(host_id):
                 return json_response(error='无权访问该主机，请联系管理员')
             return json_response(Host.objects.get(pk=host_id))
+        snapshot = Category.snapshot()
         if request.user.is_supper:
             hosts = Host.objects.filter(deleted_by_id__isnull=True)
-            categories = Category.forest()
-            zones = Category.zones()
+            categories = Category.forest(snapshot)
+            zones = Category.zones(snapshot)
         else:
             hosts = Category.hosts(request.user.category_perms)
-            categories = Category.sub_forest(request.user.category_perms)
+            categories = Category.sub_forest(request.user.category_perms, snapshot)
             zones = Category.sub_zones(categories)
-        tags = [tag.name for tag in Tag.objects.all() if tag.host_set.filter(deleted_by_id__isnull=True).count() > 0]
+        hosts = hosts.select_related('category').prefetch_related('tags')
+        tags = list(Tag.objects.filter(host__deleted_by_id__isnull=True).distinct().values_list('name', flat=True))
         perms = [x.id for x in hosts] if request.user.is_supper else request.user.host_perms
         return json_response(
             {
@@ -116,19 +126,19 @@ class HostView(View):
             Argument('id', type=int, help='请指定操作对象')
         ).parse(request.GET)
         if error is None:
-            deploy = Deploy.objects.filter(host_ids__regex=fr'\D{form.id}\D').annotate(
+            deploy = Deploy.objects.filter(hosts=form.id).annotate(
                 app_name=F('app__name'),
                 env_name=F('env__name')
             ).first()
             if deploy:
                 return json_response(error=f'应用【{deploy.app_name}】在【{deploy.env_name}】的发布配置关联了该主机，请解除关联后再尝试删除该主机')
-            task = Task.objects.filter(targets__regex=fr'\D{form.id}\D').first()
+            task = Task.objects.filter(hosts=form.id).first()
             if task:
                 return json_response(error=f'任务计划中的任务【{task.name}】关联了该主机，请解除关联后再尝试删除该主机')
             detection = Detection.objects.filter(type__in=('3', '4'), addr=form.id).first()
             if detection:
                 return json_response(error=f'监控中心的任务【{detection.name}】关联了该主机，请解除关联后再尝试删除该主机')
-            role = Role.objects.filter(host_perms__regex=fr'\D{form.id}\D').first()
+            role = Role.objects.filter(hosts=form.id).first()
             if role:
                 return json_response(error=f'角色【{role.name}】的主机权限关联了该主机，请解除关联后再尝试删除该主机')
             Host.objects.filter(pk=form.id).update(
@@ -143,6 +153,7 @@ def post_import(request):
     file = request.FILES['file']
     ws = load_workbook(file, read_only=True)['Sheet1']
     summary = {'invalid': [], 'skip': [], 'fail': [], 'network': [], 'repeat': [], 'success': [], 'error': []}
+    rows = []
     for i, row in enumerate(ws.rows):
         if i == 0:  # 第1行是表头 略过
             continue
@@ -159,40 +170,102 @@ def post_import(request):
             password=row[6].value,
             desc=row[7].value
         )
-        if Host.objects.filter(hostname=data.hostname, port=data.port, username=data.username,
-                               deleted_by_id__isnull=True).exists():
-            summary['skip'].append(i)
-            continue
         try:
-            if valid_ssh(data.hostname, data.port, data.username, data.pop('password') or password, None,
-                         False) is False:
-                summary['fail'].append(i)
-                continue
-        except AuthenticationException:
-            summary['fail'].append(i)
-            continue
-        except socket.error:
-            summary['network'].append(i)
-            continue
-        except Exception:
-            summary['error'].append(i)
-            continue
-        if Host.objects.filter(name=data.name, deleted_by_id__isnull=True).exists():
-            summary['repeat'].append(i)
+            data.port = int(data.port)
+        except ValueError:
+            summary['invalid'].append(i)
             continue
-        tags = data.pop('tags', None)
-        category = data.pop('category', None)
-        host = Host.objects.create(created_by=request.user, **data)
-        if tags is not None:
-            host.update_tags(tags.split(','))
-        if category is not None:
-            generated = host.update_category(category)
-        if request.user.role:
-            request.user.role.add_host_perm(host.id)
-            if category is not None and generated:
-                request.user.role.add_category_perms(host.category.id)
-        summary['success'].append(i)
-    return json_response(summary)
+        rows.append((i, data))
+    token = Channel.get_token()
+    importer = HostImporter(request.user, rows, password, summary, token)
+    Thread(target=importer.run).start()
+    return json_response(token)
+
+
+def get_hosts(request):
+    """
+    分页查询主机，支持按区域(含子区域)、标签、名称、主机名/IP子串及已采集的系统信息过滤排序，
+    同时返回过滤结果在各区域、标签下的数量
+    """
+    form, error = JsonParser(
+        Argument('page', type=int, default=1, filter=lambda x: x > 0, help='参数错误'),
+        Argument('page_size', type=int, default=20, filter=lambda x: 0 < x <= 500, help='每页数量需在1到500之间'),
+        Argument('zone', required=False),
+        Argument('tag', required=False),
+        Argument('name', required=False),
+        Argument('hostname', required=False),
+        Argument('os', required=False),
+        Argument('cpu', type=int, required=False),
+        Argument('memory', type=int, required=False),
+        Argument('disk', type=int, required=False),
+        Argument('sort', filter=lambda x: x.lstrip('-') in FACTS_SORTS, required=False, help='不支持的排序字段'),
+    ).parse(request.GET)
+    if error is not None:
+        return json_response(error=error)
+    Category.check_paths()
+    if request.user.is_supper:
+        hosts = Host.objects.filter(deleted_by_id__isnull=True)
+    else:
+        hosts = Category.hosts(request.user.category_perms)
+    if form.zone:
+        hosts = hosts.filter(Q(category__full_path=form.zone) | Q(category__full_path__startswith=f'{form.zone}/'))
+    if form.tag:
+        hosts = hosts.filter(tags__name=form.tag)
+    if form.name:
+        hosts = hosts.filter(name__icontains=form.name)
+    if form.hostname:
+        hosts = hosts.filter(hostname__contains=form.hostname)
+    if form.os:
+        hosts = hosts.filter(facts__os__icontains=form.os)
+    for key in ('cpu', 'memory', 'disk'):
+        if form[key] is not None:
+            hosts = hosts.filter(**{f'facts__{key}__gte': form[key]})
+    if form.sort:
+        field = F(FACTS_SORTS[form.sort.lstrip('-')])
+        hosts = hosts.order_by(field.desc(nulls_last=True) if form.sort.startswith('-') else field.asc(nulls_last=True))
+
+    zones = dict(hosts.order_by().values_list('category__full_path').annotate(count=Count('id', distinct=True)))
+    tags = dict(Tag.objects.filter(host__in=hosts.order_by().values('id'))
+                .values_list('name').annotate(count=Count('host', distinct=True)))
+    total = sum(zones.values())
+    offset = (form.page - 1) * form.page_size
+    page = hosts.select_related('category', 'facts').prefetch_related('tags')[offset:offset + form.page_size]
+    return json_response({
+        'total': total,
+        'page': form.page,
+        'page_size': form.page_size,
+        'hosts': [_host_with_facts(x) for x in page],
+        'zones': zones,
+        'tags': tags,
+    })
+
+
+def _host_with_facts(host):
+    res = host.to_dict()
+    facts = getattr(host, 'facts', None)
+    res['facts'] = facts.to_dict(excludes=('host_id', 'digest')) if facts else None
+    return res
+
+
+def post_facts(request):
+    """
+    立即采集指定主机的系统信息
+    """
+    form, error = JsonParser(
+        Argument('ids', type=list, filter=lambda x: 0 < len(x) <= 100, help='请选择1到100台主机')
+    ).parse(request.body)
+    if error is None:
+        if not request.user.has_host_perm(form.ids):
+            return json_response(error='无权访问主机，请联系管理员')
+        changed, unchanged, failed = collect_facts(Host.objects.filter(pk__in=form.ids, deleted_by_id__isnull=True))
+        facts = HostFacts.objects.filter(host_id__in=form.ids)
+        return json_response({
+            'changed': changed,
+            'unchanged': unchanged,
+            'failed': failed,
+            'facts': {x.host_id: x.to_dict(excludes=('host_id', 'digest')) for x in facts}
+        })
+    return json_response(error=error)
 
 
 def get_categories(request):
@@ -202,33 +275,6 @@ def get_categories(request):
     })
 
 
-def valid_ssh(hostname, port, username, password=None, pkey=None, with_expect=True):
-    try:
-        private_key = AppSetting.get('private_key')
-        public_key = AppSetting.get('public_key')
-    except KeyError:
-        private_key, public_key = SSH.generate_key()
-        AppSetting.set('private_key', private_key, 'ssh private key')
-        AppSetting.set('public_key', public_key, 'ssh public key')
-    if password:
-        _cli = SSH(hostname, port, username, password=str(password))
-        _cli.add_public_key(public_key)
-    if pkey:
-        private_key = pkey
-    try:
-        cli = SSH(hostname, port, username, private_key)
-        cli.ping()
-    except BadAuthenticationType:
-        if with_expect:
-            raise TypeError('该主机不支持密钥认证，请参考官方文档，错误代码：E01')
-        return False
-    except AuthenticationException:
-        if password and with_expect:
-            raise ValueError('密钥认证失败，请参考官方文档，错误代码：E02')
-        return False
-    return True
-
-
 def post_parse(request):
     file = request.FILES['file']
     if file:
@@ -1,20 +1,40 @@
 # Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
 # Copyright: (c) <spug.dev@gmail.com>
 # Released under the AGPL-3.0 License.
+from apscheduler.executors.base import BaseExecutor
+from apscheduler.executors.base_py3 import run_coroutine_job
+from apscheduler.events import JobExecutionEvent, EVENT_JOB_EXECUTED
+from django.db import close_old_connections
 from apps.host.models import Host
-from socket import socket
+from collections import defaultdict
+from concurrent import futures
+from threading import Thread, Timer, Lock
+import sys
+from socket import socket, SOCK_STREAM
 import requests
+import aiohttp
+import asyncio
 import logging
+import time
 
 logging.captureWarnings(True)
 
+PROBE_CONCURRENCY = 2000
+DNS_CACHE_TTL = 300
+# 脚本检测的输出会写入报警通知，仅保留开头和末尾各4KB
+OUTPUT_CAPTURE = (4096, 4096)
+
+_session = None
+_semaphore = None
+_dns_cache = {}
+
 
 def site_check(url):
     try:
         res = requests.get(url, timeout=10, verify=False)
-        return 200 <= res.status_code < 400, f'返回状态码：{res.status_code}'
+        return 200 <= res.status_code < 400, f'返回状态码：{res.status_code}', res.status_code
     except Exception as e:
-        return False, f'异常信息：{e}'
+        return False, f'异常信息：{e}', None
 
 
 def port_check(addr, port):
@@ -22,33 +42,195 @@ def port_check(addr, port):
         sock = socket()
         sock.settimeout(5)
         sock.connect((addr, int(port)))
-        return True, '端口状态检测正常'
+        return True, '端口状态检测正常', None
     except Exception as e:
-        return False, f'异常信息：{e}'
+        return False, f'异常信息：{e}', None
 
 
 def host_executor(host, command):
     try:
         cli = host.get_ssh()
-        exit_code, out = cli.exec_command(command)
+        exit_code, out = cli.exec_command(command, capture=OUTPUT_CAPTURE)
         if exit_code == 0:
-            return True, out or '检测状态正常'
+            return True, out or '检测状态正常', exit_code
         else:
-            return False, out or f'退出状态码：{exit_code}'
+            return False, out or f'退出状态码：{exit_code}', exit_code
     except Exception as e:
-        return False, f'异常信息：{e}'
+        return False, f'异常信息：{e}', None
 
 
-def dispatch(tp, addr, extra):
-    if tp == '1':
-        return site_check(addr)
-    elif tp == '2':
-        return port_check(addr, extra)
-    elif tp == '3':
-        command = f'ps -ef|grep -v grep|grep {extra!r}'
+def host_batch_executor(host, commands):
+    try:
+        cli = host.get_ssh()
+        results = []
+        for exit_code, out in cli.exec_commands(commands, capture=OUTPUT_CAPTURE):
+            if exit_code == 0:
+                results.append((True, out or '检测状态正常', exit_code))
+            else:
+                results.append((False, out or f'退出状态码：{exit_code}', exit_code))
+        return results
+    except Exception as e:
+        return [(False, f'异常信息：{e}', None)] * len(commands)
+
+
+def parse_command(tp, extra):
+    if tp == '3':
+        return f'ps -ef|grep -v grep|grep {extra!r}'
     elif tp == '4':
-        command = extra
+        return extra
     else:
         raise TypeError(f'invalid monitor type: {tp!r}')
+
+
+def _with_latency(start, result):
+    is_ok, out, code = result
+    return is_ok, out, int((time.time() - start) * 1000), code
+
+
+def dispatch(tp, addr, extra):
+    start = time.time()
+    if tp == '1':
+        return _with_latency(start, site_check(addr))
+    elif tp == '2':
+        return _with_latency(start, port_check(addr, extra))
+    command = parse_command(tp, extra)
     host = Host.objects.filter(pk=addr).first()
-    return host_executor(host, command)
+    return _with_latency(start, host_executor(host, command))
+
+
+def _get_session():
+    global _session, _semaphore
+    if _session is None:
+        connector = aiohttp.TCPConnector(limit=PROBE_CONCURRENCY, ttl_dns_cache=DNS_CACHE_TTL, ssl=False)
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=10))
+        _semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+    return _session
+
+
+async def _resolve(addr, port):
+    key = (addr, port)
+    expire, info = _dns_cache.get(key, (0, None))
+    if expire < time.time():
+        loop = asyncio.get_event_loop()
+        info = (await loop.getaddrinfo(addr, port, type=SOCK_STREAM))[0]
+        _dns_cache[key] = (time.time() + DNS_CACHE_TTL, info)
+    return info
+
+
+async def async_site_check(url):
+    try:
+        async with _get_session().get(url) as res:
+            return 200 <= res.status < 400, f'返回状态码：{res.status}', res.status
+    except asyncio.TimeoutError:
+        return False, '异常信息：请求超时', None
+    except Exception as e:
+        return False, f'异常信息：{e}', None
+
+
+async def async_port_check(addr, port):
+    _get_session()
+    try:
+        async with _semaphore:
+            family, _, _, _, sockaddr = await _resolve(addr, int(port))
+            _, writer = await asyncio.wait_for(asyncio.open_connection(sockaddr[0], sockaddr[1], family=family), 5)
+            writer.close()
+        return True, '端口状态检测正常', None
+    except asyncio.TimeoutError:
+        return False, '异常信息：连接超时', None
+    except Exception as e:
+        return False, f'异常信息：{e}', None
+
+
+async def async_dispatch(tp, addr, extra):
+    start = time.time()
+    if tp == '1':
+        return _with_latency(start, await async_site_check(addr))
+    elif tp == '2':
+        return _with_latency(start, await async_port_check(addr, extra))
+    else:
+        raise TypeError(f'invalid async monitor type: {tp!r}')
+
+
+class ProbeExecutor(BaseExecutor):
+    """
+    在独立线程的事件循环中运行协程任务，适用于站点检测和端口检测，
+    单个进程可同时保持数千个检测请求，执行结果仍通过调度器的事件监听器处理
+    """
+
+    def __init__(self, max_handlers=5):
+        super().__init__()
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._loop.run_forever, daemon=True)
+        self._handlers = futures.ThreadPoolExecutor(max_handlers)
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        self._thread.start()
+
+    def shutdown(self, wait=True):
+        if _session is not None:
+            asyncio.run_coroutine_threadsafe(_session.close(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._handlers.shutdown(wait)
+
+    def _do_submit_job(self, job, run_times):
+        def callback(f):
+            exc = f.exception()
+            if exc:
+                self._run_job_error(job.id, exc, exc.__traceback__)
+            else:
+                self._run_job_success(job.id, f.result())
+
+        coro = run_coroutine_job(job, job._jobstore_alias, run_times, self._logger.name)
+        f = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        # 事件监听器中包含数据库操作，转交给线程池处理以免阻塞事件循环
+        f.add_done_callback(lambda x: self._handlers.submit(callback, x))
+
+
+class HostExecutor(BaseExecutor):
+    """
+    进程检测和自定义脚本检测按主机合并执行，同一主机在 window 秒内到期的检测任务
+    共用一个SSH连接，每个任务使用独立的channel，执行结果再分发给各自的任务
+    """
+
+    def __init__(self, max_workers=20, window=1):
+        super().__init__()
+        self._pool = futures.ThreadPoolExecutor(max_workers)
+        self._window = window
+        self._pending = defaultdict(list)
+        self._pending_lock = Lock()
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait)
+
+    def _do_submit_job(self, job, run_times):
+        addr = job.args[1]
+        with self._pending_lock:
+            self._pending[addr].append((job, run_times))
+            if len(self._pending[addr]) == 1:
+                Timer(self._window, self._flush, args=(addr,)).start()
+
+    def _flush(self, addr):
+        with self._pending_lock:
+            batch = self._pending.pop(addr, [])
+        if batch:
+            self._pool.submit(self._run_batch, addr, batch)
+
+    def _run_batch(self, addr, batch):
+        try:
+            close_old_connections()
+            host = Host.objects.filter(pk=addr).first()
+            if not host:
+                raise ValueError(f'unknown host id: {addr!r}')
+            commands = [parse_command(job.args[0], job.args[2]) for job, _ in batch]
+            # 同一连接内的命令并发执行，耗时按整批计算
+            start = time.time()
+            results = [_with_latency(start, x) for x in host_batch_executor(host, commands)]
+        except Exception:
+            for job, _ in batch:
+                self._run_job_error(job.id, *sys.exc_info()[1:])
+            return
+        for (job, run_times), retval in zip(batch, results):
+            events = [JobExecutionEvent(EVENT_JOB_EXECUTED, job.id, job._jobstore_alias, x, retval=retval)
+                      for x in run_times]
+            self._run_job_success(job.id, events)
@@ -0,0 +1,127 @@
+# Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
+# Copyright: (c) <spug.dev@gmail.com>
+# Released under the AGPL-3.0 License.
+from django_redis import get_redis_connection
+from django.conf import settings
+import time
+
+# 原始数据点保留条数（环形缓冲）
+RAW_SIZE = 1440
+# 聚合粒度(秒) -> 保留时长(秒)，每个聚合桶为独立的hash，到期自动删除
+RESOLUTIONS = (
+    (60, 24 * 3600),
+    (3600, 30 * 24 * 3600),
+    (24 * 3600, 365 * 24 * 3600),
+)
+# 单次查询最多读取的聚合桶数量，据此选择合适的聚合粒度
+MAX_BUCKETS = 500
+# 耗时直方图的区间上限(毫秒)，最后一个区间为大于10s
+LATENCY_BOUNDS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _raw_key(d_id):
+    return f'{settings.MONITOR_KEY}:ts:{d_id}:raw'
+
+
+def _bucket_key(d_id, step, bucket):
+    return f'{settings.MONITOR_KEY}:ts:{d_id}:{step}:{bucket}'
+
+
+def _bin_index(latency):
+    for index, bound in enumerate(LATENCY_BOUNDS):
+        if latency <= bound:
+            return index
+    return len(LATENCY_BOUNDS)
+
+
+def record(d_id, is_ok, latency, code, ts=None, rds=None):
+    rds = rds or get_redis_connection()
+    ts = int(ts or time.time())
+    code = '' if code is None else code
+    with rds.pipeline(transaction=False) as pipe:
+        pipe.lpush(_raw_key(d_id), f'{ts},{int(is_ok)},{latency},{code}')
+        pipe.ltrim(_raw_key(d_id), 0, RAW_SIZE - 1)
+        for step, retention in RESOLUTIONS:
+            key = _bucket_key(d_id, step, ts - ts % step)
+            pipe.hincrby(key, 'n', 1)
+            pipe.hincrby(key, 'ok', int(is_ok))
+            pipe.hincrby(key, 'sum', latency)
+            pipe.hincrby(key, f'b{_bin_index(latency)}', 1)
+            pipe.expire(key, retention + step)
+        pipe.execute()
+
+
+def remove(d_id, rds=None):
+    rds = rds or get_redis_connection()
+    keys = list(rds.scan_iter(f'{settings.MONITOR_KEY}:ts:{d_id}:*', count=1000))
+    if keys:
+        rds.delete(*keys)
+
+
+def fetch_raw(d_id, limit=100, rds=None):
+    rds = rds or get_redis_connection()
+    points = []
+    for item in rds.lrange(_raw_key(d_id), 0, limit - 1):
+        ts, is_ok, latency, code = item.decode().split(',')
+        points.append({
+            'time': int(ts),
+            'ok': is_ok == '1',
+            'latency': int(latency),
+            'code': int(code) if code else None
+        })
+    return points
+
+
+def _percentile(bins, total, percent):
+    if not total:
+        return None
+    threshold, count = total * percent / 100, 0
+    for index, value in enumerate(bins):
+        count += value
+        if count >= threshold:
+            return LATENCY_BOUNDS[index] if index < len(LATENCY_BOUNDS) else None
+    return None
+
+
+def _summary(n, ok, latency_sum, bins):
+    return {
+        'count': n,
+        'availability': round(ok * 100 / n, 3) if n else None,
+        'avg': round(latency_sum / n, 1) if n else None,
+        'p50': _percentile(bins, n, 50),
+        'p90': _percentile(bins, n, 90),
+        'p95': _percentile(bins, n, 95),
+        'p99': _percentile(bins, n, 99),
+    }
+
+
+def query(d_id, start, end, rds=None):
+    """
+    基于聚合桶计算时间范围内的可用率和耗时分位数（取直方图区间上限，单位毫秒），
+    不扫描原始数据点，超出10s的分位数返回None
+    """
+    rds = rds or get_redis_connection()
+    now = int(time.time())
+    # 超出最长保留时长的数据已过期，限定查询范围以控制读取的聚合桶数量
+    start, end = max(start, now - RESOLUTIONS[-1][1]), min(end, now)
+    for step, retention in RESOLUTIONS:
+        if (end - start) / step <= MAX_BUCKETS and start >= now - retention:
+            break
+    buckets = list(range(start - start % step, end + 1, step))
+    with rds.pipeline(transaction=False) as pipe:
+        for bucket in buckets:
+            pipe.hgetall(_bucket_key(d_id, step, bucket))
+        records = pipe.execute()
+
+    total_n, total_ok, total_sum, total_bins, points = 0, 0, 0, [0] * (len(LATENCY_BOUNDS) + 1), []
+    for bucket, data in zip(buckets, records):
+        if not data:
+            continue
+        data = {k.decode(): int(v) for k, v in data.items()}
+        bins = [data.get(f'b{i}', 0) for i in range(len(LATENCY_BOUNDS) + 1)]
+        total_n += data['n']
+        total_ok += data['ok']
+        total_sum += data['sum']
+        total_bins = [x + y for x, y in zip(total_bins, bins)]
+        points.append({'time': bucket, **_summary(data['n'], data['ok'], data['sum'], bins)})
+    return {'step': step, 'summary': _summary(total_n, total_ok, total_sum, total_bins), 'points': points}
@@ -30,6 +30,7 @@ class Detection(models.Model, ModelMixin):
     fault_times = models.SmallIntegerField(default=0)
     notify_mode = models.CharField(max_length=255)
     notify_grp = models.CharField(max_length=255)
+    groups = models.ManyToManyField('alarm.Group', related_name='detections', db_table='detection_groups')
     latest_status = models.SmallIntegerField(choices=STATUS, null=True)
     latest_run_time = models.CharField(max_length=20, null=True)
     latest_fault_time = models.IntegerField(null=True)
@@ -48,6 +49,9 @@ class Detection(models.Model, ModelMixin):
         tmp['notify_grp'] = json.loads(self.notify_grp)
         return tmp
 
+    def sync_refs(self):
+        self.set_refs('groups', json.loads(self.notify_grp))
+
     def __repr__(self):
         return '<Detection %r>' % self.name
 
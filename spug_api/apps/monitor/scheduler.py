@@ -10,12 +10,14 @@ from django.utils.functional import SimpleLazyObject
 from django.db import close_old_connections
 from apps.monitor.models import Detection
 from apps.alarm.models import Alarm
-from apps.monitor.executors import dispatch
-from apps.monitor.utils import seconds_to_human
+from apps.monitor.executors import dispatch, async_dispatch, ProbeExecutor, HostExecutor
+from apps.monitor.utils import seconds_to_human, load_state, save_state, flush_states
+from apps.monitor import metrics
 from apps.notify.models import Notify
 from django.conf import settings
-from libs import spug, AttrDict, human_datetime, human_diff_time
+from libs import spug, AttrDict, human_datetime, human_diff_time, phase_start_date
 from datetime import datetime
+from threading import Lock, Timer
 import logging
 import json
 import time
@@ -27,10 +29,17 @@ class Scheduler:
     timezone = settings.TIME_ZONE
 
     def __init__(self):
-        self.scheduler = BackgroundScheduler(timezone=self.timezone, executors={'default': ThreadPoolExecutor(20)})
+        self.scheduler = BackgroundScheduler(timezone=self.timezone, executors={
+            'default': ThreadPoolExecutor(20),
+            'probe': ProbeExecutor(),
+            'host': HostExecutor(),
+        })
         self.scheduler.add_listener(
             self._handle_event,
             EVENT_SCHEDULER_SHUTDOWN | EVENT_JOB_ERROR | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_EXECUTED)
+        self.detections = {}
+        self.notifies = {}
+        self.notify_lock = Lock()
 
     def _record_alarm(self, obj, status):
         duration = seconds_to_human(time.time() - obj.latest_fault_time)
@@ -42,12 +51,8 @@ class Scheduler:
             notify_grp=obj.notify_grp,
             notify_mode=obj.notify_mode)
 
-    def _do_notify(self, event, obj, out):
-        obj.out = out
-        obj.grp = json.loads(obj.notify_grp)
-        if event == '2':
-            obj.duration = human_diff_time(datetime.now(), datetime.fromtimestamp(obj.latest_fault_time))
-        for mode in json.loads(obj.notify_mode):
+    def _send_notify(self, event, obj):
+        for mode in obj.modes:
             if mode == '1':
                 spug.notify_by_wx(event, obj)
             elif mode == '3':
@@ -57,6 +62,51 @@ class Scheduler:
             elif mode == '5':
                 spug.notify_by_qy_wx(event, obj)
 
+    def _flush_notify(self, key):
+        with self.notify_lock:
+            items = self.notifies.pop(key, [])
+        if not items:
+            return
+        close_old_connections()
+        event, obj = key[0], items[0]
+        if len(items) > 1:
+            action = '告警' if event == '1' else '恢复'
+            lines = [f'{x.name}：{x.out}' for x in items[:20]]
+            if len(items) > 20:
+                lines.append(f'...其余{len(items) - 20}项略')
+            obj = AttrDict(
+                name=f'{obj.name}等{len(items)}个监控项',
+                out=f'共{len(items)}个监控项{action}\n' + '\n'.join(lines),
+                grp=obj.grp,
+                modes=obj.modes,
+                duration=min(items, key=lambda x: x.fault_time).duration if event == '2' else None)
+        self._send_notify(event, obj)
+
+    def _do_notify(self, event, obj, out):
+        """
+        同一报警组、通知方式的报警在 MONITOR_NOTIFY_WINDOW 秒内合并为一条汇总通知发送
+        """
+        item = AttrDict(
+            name=obj.name,
+            out=out,
+            grp=json.loads(obj.notify_grp),
+            modes=json.loads(obj.notify_mode),
+            fault_time=obj.latest_fault_time,
+            duration=None)
+        if event == '2':
+            item.duration = human_diff_time(datetime.now(), datetime.fromtimestamp(obj.latest_fault_time))
+        window = settings.MONITOR_NOTIFY_WINDOW
+        if not window:
+            return self._send_notify(event, item)
+        key = (event, tuple(sorted(item.grp)), tuple(sorted(item.modes)))
+        with self.notify_lock:
+            items = self.notifies.setdefault(key, [])
+            items.append(item)
+            if len(items) == 1:
+                timer = Timer(window, self._flush_notify, args=(key,))
+                timer.daemon = True
+                timer.start()
+
     def _handle_notify(self, obj, is_notified, out):
         if obj.latest_status == 0:
             if is_notified:
@@ -67,7 +117,7 @@ class Scheduler:
             if obj.fault_times >= obj.threshold:
                 if time.time() - obj.latest_notify_time >= obj.quiet * 60:
                     obj.latest_notify_time = int(time.time())
-                    obj.save()
+                    save_state(obj)
                     self._record_alarm(obj, '1')
                     logger.info(f'{human_datetime()} notify job_id: {obj.id}')
                     self._do_notify('1', obj, out)
@@ -78,15 +128,19 @@ class Scheduler:
         if event.code == EVENT_SCHEDULER_SHUTDOWN:
             logger.info(f'EVENT_SCHEDULER_SHUTDOWN: {event}')
             Notify.make_notify('monitor', '1', '调度器已关闭', '调度器意外关闭，你可以在github上提交issue', False)
+        elif event.code in (EVENT_JOB_MAX_INSTANCES, EVENT_JOB_ERROR) and not (str(event.job_id).isdigit() and obj):
+            # 内置任务（例如定期回写状态）或已删除的监控任务，仅记录日志
+            logger.error(f'job {event.job_id} event {event.code}: {getattr(event, "exception", None)}')
         elif event.code == EVENT_JOB_MAX_INSTANCES:
             logger.info(f'EVENT_JOB_MAX_INSTANCES: {event}')
             Notify.make_notify('monitor', '1', f'{obj.name} - 达到调度实例上限', '一般为上个周期的执行任务还未结束，请增加调度间隔或减少任务执行耗时')
         elif event.code == EVENT_JOB_ERROR:
             logger.info(f'EVENT_JOB_ERROR: job_id {event.job_id} exception: {event.exception}')
             Notify.make_notify('monitor', '1', f'{obj.name} - 执行异常', f'{event.exception}')
-        elif event.code == EVENT_JOB_EXECUTED:
-            is_ok, out = event.retval
-            obj = Detection.objects.filter(pk=event.job_id).first()
+        elif event.code == EVENT_JOB_EXECUTED and event.retval:
+            is_ok, out, latency, code = event.retval
+            obj = load_state(self._get_detection(event.job_id))
+            metrics.record(obj.id, is_ok, latency, code)
             is_notified = True if obj.latest_notify_time else False
             if obj.latest_status in [0, None] and is_ok is False:
                 obj.latest_fault_time = int(time.time())
@@ -97,19 +151,50 @@ class Scheduler:
                 obj.fault_times += 1
             obj.latest_status = 0 if is_ok else 1
             obj.latest_run_time = human_datetime(event.scheduled_run_time)
-            obj.save()
+            save_state(obj)
             self._handle_notify(obj, is_notified, out)
 
+    def _get_detection(self, job_id):
+        obj = self.detections.get(job_id)
+        if obj is None:
+            obj = Detection.objects.filter(pk=job_id).first()
+            self.detections[job_id] = obj
+        return obj
+
+    def _init_builtin_jobs(self):
+        self.scheduler.add_job(flush_states, 'interval', seconds=30)
+
+    @classmethod
+    def parse_trigger(cls, job_id, tp, addr, rate):
+        interval = int(rate) * 60
+        if tp in ('3', '4'):
+            # 基于主机的检测按主机计算相位且不加抖动，保证同一主机的检测同时到期以便合并执行
+            start_date, jitter = phase_start_date(f'host:{addr}', interval), None
+        else:
+            start_date, jitter = phase_start_date(job_id, interval), settings.MONITOR_JITTER or None
+        return IntervalTrigger(seconds=interval, start_date=start_date, jitter=jitter, timezone=cls.timezone)
+
+    def _add_job(self, job_id, tp, addr, extra, rate, replace_existing=False):
+        trigger = self.parse_trigger(job_id, tp, addr, rate)
+        if tp in ('1', '2'):
+            func, executor = async_dispatch, 'probe'
+        else:
+            func, executor = dispatch, 'host'
+        self.scheduler.add_job(
+            func,
+            trigger,
+            id=str(job_id),
+            args=(tp, addr, extra),
+            executor=executor,
+            replace_existing=replace_existing
+        )
+
     def _init(self):
         self.scheduler.start()
+        self._init_builtin_jobs()
         for item in Detection.objects.filter(is_active=True):
-            trigger = IntervalTrigger(minutes=int(item.rate), timezone=self.timezone)
-            self.scheduler.add_job(
-                dispatch,
-                trigger,
-                id=str(item.id),
-                args=(item.type, item.addr, item.extra),
-            )
+            self.detections[str(item.id)] = item
+            self._add_job(item.id, item.type, item.addr, item.extra, item.rate)
 
     def run(self):
         rds_cli = get_redis_connection()
@@ -120,15 +205,10 @@ class Scheduler:
             _, data = rds_cli.brpop(settings.MONITOR_KEY)
             task = AttrDict(json.loads(data))
             if task.action in ('add', 'modify'):
-                trigger = IntervalTrigger(minutes=int(task.rate), timezone=self.timezone)
-                self.scheduler.add_job(
-                    dispatch,
-                    trigger,
-                    id=str(task.id),
-                    args=(task.type, task.addr, task.extra),
-                    replace_existing=True
-                )
+                self.detections.pop(str(task.id), None)
+                self._add_job(task.id, task.type, task.addr, task.extra, task.rate, True)
             elif task.action == 'remove':
                 job = self.scheduler.get_job(str(task.id))
                 if job:
                     job.remove()
+                self.detections.pop(str(task.id), None)
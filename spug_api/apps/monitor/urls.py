@@ -7,4 +7,6 @@ from .views import *
 
 urlpatterns = [
     path('', DetectionView.as_view()),
+    path('metric/', MetricView.as_view()),
+    path('load/', get_load),
 ]
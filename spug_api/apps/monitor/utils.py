@@ -1,6 +1,16 @@
 # Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
 # Copyright: (c) <spug.dev@gmail.com>
 # Released under the AGPL-3.0 License.
+from django_redis import get_redis_connection
+from django.conf import settings
+from django.db import transaction
+from apps.monitor.models import Detection
+
+# 监控任务的运行状态以Redis为准，定期批量回写至数据库
+STATE_FIELDS = ('fault_times', 'latest_status', 'latest_run_time', 'latest_fault_time', 'latest_notify_time')
+STATE_DIRTY_KEY = f'{settings.MONITOR_KEY}:dirty'
+
+
 def seconds_to_human(seconds):
     text = ''
     if seconds > 3600:
@@ -10,3 +20,68 @@ def seconds_to_human(seconds):
         text += f'{int(seconds / 60)}分钟'
         seconds = seconds % 60
     return f'{text}{int(seconds)}秒'
+
+
+def _state_key(d_id):
+    return f'{settings.MONITOR_KEY}:state:{d_id}'
+
+
+def _parse_state(data):
+    state = {}
+    for key, value in data.items():
+        key, value = key.decode(), value.decode()
+        if key == 'latest_run_time':
+            state[key] = value or None
+        else:
+            state[key] = int(value) if value else None
+    state['fault_times'] = state.get('fault_times') or 0
+    state['latest_notify_time'] = state.get('latest_notify_time') or 0
+    return state
+
+
+def get_states(ids, rds=None):
+    rds = rds or get_redis_connection()
+    with rds.pipeline(transaction=False) as pipe:
+        for d_id in ids:
+            pipe.hgetall(_state_key(d_id))
+        return {d_id: _parse_state(x) for d_id, x in zip(ids, pipe.execute()) if x}
+
+
+def load_state(obj, rds=None):
+    state = get_states([obj.id], rds).get(obj.id)
+    if state:
+        for key, value in state.items():
+            setattr(obj, key, value)
+    return obj
+
+
+def save_state(obj, rds=None):
+    rds = rds or get_redis_connection()
+    mapping = {x: '' if getattr(obj, x) is None else getattr(obj, x) for x in STATE_FIELDS}
+    with rds.pipeline(transaction=False) as pipe:
+        pipe.hmset(_state_key(obj.id), mapping)
+        pipe.sadd(STATE_DIRTY_KEY, obj.id)
+        pipe.execute()
+
+
+def remove_state(d_id, rds=None):
+    rds = rds or get_redis_connection()
+    with rds.pipeline(transaction=False) as pipe:
+        pipe.delete(_state_key(d_id))
+        pipe.srem(STATE_DIRTY_KEY, d_id)
+        pipe.execute()
+
+
+def flush_states(batch_size=500):
+    rds = get_redis_connection()
+    count = rds.scard(STATE_DIRTY_KEY)
+    if count:
+        ids = [int(x) for x in rds.spop(STATE_DIRTY_KEY, count)]
+        try:
+            objects = [Detection(id=k, **v) for k, v in get_states(ids, rds).items()]
+            with transaction.atomic():
+                Detection.objects.bulk_update(objects, STATE_FIELDS, batch_size=batch_size)
+        except Exception:
+            # 回写失败时重新标记，等待下一次回写
+            rds.sadd(STATE_DIRTY_KEY, *ids)
+            raise
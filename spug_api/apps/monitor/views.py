@@ -2,16 +2,24 @@
 # Copyright: (c) <spug.dev@gmail.com>
 # Released under the AGPL-3.0 License.
 from django.views.generic import View
-from libs import json_response, JsonParser, Argument, human_datetime
+from libs import json_response, JsonParser, Argument, human_datetime, fire_histogram
 from apps.monitor.models import Detection
+from apps.monitor.scheduler import Scheduler
+from apps.monitor.utils import get_states, remove_state
+from apps.monitor import metrics
 from django_redis import get_redis_connection
 from django.conf import settings
 import json
+import time
 
 
 class DetectionView(View):
     def get(self, request):
         detections = Detection.objects.all()
+        states = get_states([x.id for x in detections])
+        for item in detections:
+            for key, value in states.get(item.id, {}).items():
+                setattr(item, key, value)
         return json_response(detections)
 
     def post(self, request):
@@ -37,12 +45,15 @@ class DetectionView(View):
                     updated_by=request.user,
                     **form)
                 task = Detection.objects.filter(pk=form.id).first()
+                if task:
+                    task.sync_refs()
                 if task and task.is_active:
                     form.action = 'modify'
                     rds_cli = get_redis_connection()
                     rds_cli.lpush(settings.MONITOR_KEY, json.dumps(form))
             else:
                 dtt = Detection.objects.create(created_by=request.user, **form)
+                dtt.sync_refs()
                 form.action = 'add'
                 form.id = dtt.id
                 rds_cli = get_redis_connection()
@@ -77,4 +88,40 @@ class DetectionView(View):
                 if task.is_active:
                     return json_response(error='该监控项正在运行中，请先停止后再尝试删除')
                 task.delete()
+                remove_state(task.id)
+                metrics.remove(task.id)
         return json_response(error=error)
+
+
+class MetricView(View):
+    def get(self, request):
+        form, error = JsonParser(
+            Argument('id', type=int, help='请指定监控任务'),
+            Argument('start', type=int, required=False),
+            Argument('end', type=int, required=False),
+            Argument('raw', type=int, default=0),
+        ).parse(request.GET)
+        if error is None:
+            if not Detection.objects.filter(pk=form.id).exists():
+                return json_response(error='未找到指定监控任务')
+            form.end = form.end or int(time.time())
+            form.start = form.start or form.end - 24 * 3600
+            if form.start >= form.end:
+                return json_response(error='无效的时间范围')
+            data = metrics.query(form.id, form.start, form.end)
+            if form.raw:
+                data['raw'] = metrics.fetch_raw(form.id, min(form.raw, metrics.RAW_SIZE))
+            return json_response(data)
+        return json_response(error=error)
+
+
+def get_load(request):
+    form, error = JsonParser(
+        Argument('cycle', type=int, default=3600, filter=lambda x: 60 <= x <= 86400, help='请输入60~86400之间的统计周期'),
+    ).parse(request.GET)
+    if error is None:
+        triggers = []
+        for item in Detection.objects.filter(is_active=True):
+            triggers.append(Scheduler.parse_trigger(item.id, item.type, item.addr, item.rate))
+        return json_response(fire_histogram(triggers, form.cycle))
+    return json_response(error=error)
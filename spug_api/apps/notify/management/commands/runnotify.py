@@ -0,0 +1,13 @@
+# Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
+# Copyright: (c) <spug.dev@gmail.com>
+# Released under the AGPL-3.0 License.
+from django.core.management.base import BaseCommand
+from apps.notify.outbox import Outbox
+
+
+class Command(BaseCommand):
+    help = 'Start notify process'
+
+    def handle(self, *args, **options):
+        s = Outbox()
+        s.run()
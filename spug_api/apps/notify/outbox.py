@@ -0,0 +1,113 @@
+# Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
+# Copyright: (c) <spug.dev@gmail.com>
+# Released under the AGPL-3.0 License.
+from django_redis import get_redis_connection
+from django.db import close_old_connections
+from django.conf import settings
+from apps.notify.models import Notify
+from requests.adapters import HTTPAdapter
+from concurrent import futures
+from threading import local, BoundedSemaphore
+import requests
+import logging
+import json
+import time
+
+logger = logging.getLogger('django.apps.notify')
+
+RETRY_KEY = f'{settings.NOTIFY_KEY}:retry'
+MAX_WORKERS = 10
+MAX_RETRIES = 5
+RETRY_BASE = 5
+# 钉钉/企业微信表示系统繁忙或触发限流的errcode，可稍后重试
+RETRY_ERRCODES = (-1, 130101, 45009, 45033)
+
+
+def push(url, data, source, title, mode=None):
+    """
+    将通知消息写入发送队列，由 runnotify 进程异步发送
+
+    Args:
+        url: 接收通知的地址
+        data: 以json格式POST的数据
+        source: 发送失败时记录的通知来源，参考 Notify.SOURCES
+        title: 发送失败时记录的通知标题
+        mode: 响应检查方式，dd/wx 检查errcode，spug 检查error，None 仅检查状态码
+    """
+    message = {'url': url, 'data': data, 'source': source, 'title': title, 'mode': mode, 'attempts': 0}
+    rds = get_redis_connection()
+    rds.lpush(settings.NOTIFY_KEY, json.dumps(message))
+
+
+def _check_response(res, mode):
+    """
+    返回 (错误信息, 是否可重试)，仅超时、连接异常、5xx、429及限流类errcode会重试
+    """
+    if res.status_code != 200:
+        retryable = res.status_code >= 500 or res.status_code == 429
+        return f'返回状态码：{res.status_code}, 请求URL：{res.url}', retryable
+    if mode in ('dd', 'wx'):
+        res = res.json()
+        if res.get('errcode') != 0:
+            return f'返回数据：{res}', res.get('errcode') in RETRY_ERRCODES
+    elif mode == 'spug':
+        res = res.json()
+        if res.get('error'):
+            return f'错误信息：{res}', False
+    return None, False
+
+
+class Outbox:
+    def __init__(self):
+        self.rds = get_redis_connection()
+        self.executor = futures.ThreadPoolExecutor(MAX_WORKERS)
+        self.semaphore = BoundedSemaphore(MAX_WORKERS)
+        self.local = local()
+
+    def _get_session(self):
+        if not hasattr(self.local, 'session'):
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_maxsize=MAX_WORKERS))
+            session.mount('https://', HTTPAdapter(pool_maxsize=MAX_WORKERS))
+            self.local.session = session
+        return self.local.session
+
+    def _send(self, message):
+        try:
+            res = self._get_session().post(message['url'], json=message['data'], timeout=10)
+            error, retryable = _check_response(res, message['mode'])
+        except Exception as e:
+            error = f'异常信息：{e}, 请求URL：{message["url"]}'
+            retryable = isinstance(e, (requests.Timeout, requests.ConnectionError))
+        finally:
+            self.semaphore.release()
+        if error:
+            self._handle_fail(message, error, retryable)
+
+    def _handle_fail(self, message, error, retryable):
+        message['attempts'] += 1
+        if not retryable or message['attempts'] > MAX_RETRIES:
+            logger.info(f'notify failed after {message["attempts"]} attempts: {error}')
+            close_old_connections()
+            Notify.make_notify(message['source'], '1', message['title'], error)
+        else:
+            delay = RETRY_BASE * 2 ** (message['attempts'] - 1)
+            self.rds.zadd(RETRY_KEY, {json.dumps(message): time.time() + delay})
+
+    def _requeue(self):
+        now = time.time()
+        items = self.rds.zrangebyscore(RETRY_KEY, 0, now)
+        if items:
+            with self.rds.pipeline() as pipe:
+                pipe.zremrangebyscore(RETRY_KEY, 0, now)
+                pipe.lpush(settings.NOTIFY_KEY, *items)
+                pipe.execute()
+
+    def run(self):
+        logger.info('Running notify')
+        while True:
+            self._requeue()
+            data = self.rds.brpop(settings.NOTIFY_KEY, timeout=1)
+            if data:
+                self.semaphore.acquire()
+                self.executor.submit(self._send, json.loads(data[1]))
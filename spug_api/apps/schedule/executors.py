@@ -3,7 +3,7 @@
 # Released under the AGPL-3.0 License.
 from queue import Queue
 from threading import Thread
-from libs.ssh import AuthenticationException
+from libs.ssh import AuthenticationException, OutputCapture, CAPTURE_HEAD, CAPTURE_TAIL
 from apps.host.models import Host
 from django.db import close_old_connections
 import subprocess
@@ -14,18 +14,18 @@ import time
 def local_executor(q, command):
     exit_code, out, now = -1, None, time.time()
     try:
-        task = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        task = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = OutputCapture().read_from(task.stdout.read).getvalue()
         exit_code = task.wait()
-        out = task.stdout.read() + task.stderr.read()
     finally:
-        q.put(('local', exit_code, round(time.time() - now, 3), out.decode()))
+        q.put(('local', exit_code, round(time.time() - now, 3), out))
 
 
 def host_executor(q, host, command):
     exit_code, out, now = -1, None, time.time()
     try:
         cli = host.get_ssh()
-        exit_code, out = cli.exec_command(command)
+        exit_code, out = cli.exec_command(command, capture=(CAPTURE_HEAD, CAPTURE_TAIL))
         out = out if out else None
     except AuthenticationException:
         out = 'ssh authentication fail'
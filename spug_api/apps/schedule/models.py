@@ -39,6 +39,7 @@ class Task(models.Model, ModelMixin):
     type = models.CharField(max_length=50)
     command = models.TextField()
     targets = models.TextField()
+    hosts = models.ManyToManyField('host.Host', related_name='tasks', db_table='task_hosts')
     trigger = models.CharField(max_length=20, choices=TRIGGERS)
     trigger_args = models.CharField(max_length=255)
     is_active = models.BooleanField(default=False)
@@ -62,6 +63,9 @@ class Task(models.Model, ModelMixin):
             tmp['trigger_args'] = json.loads(self.trigger_args)
         return tmp
 
+    def sync_refs(self):
+        self.set_refs('hosts', json.loads(self.targets))
+
     def __repr__(self):
         return '<Task %r>' % self.name
 
@@ -16,8 +16,9 @@ from apps.notify.models import Notify
 from apps.schedule.executors import dispatch
 from apps.schedule.utils import auto_clean_schedule_history
 from apps.alarm.utils import auto_clean_records
+from apps.host.utils import auto_refresh_facts
 from django.conf import settings
-from libs import AttrDict, human_datetime
+from libs import AttrDict, human_datetime, phase_start_date
 import logging
 import json
 
@@ -45,9 +46,12 @@ class Scheduler:
             EVENT_SCHEDULER_SHUTDOWN | EVENT_JOB_ERROR | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_EXECUTED)
 
     @classmethod
-    def parse_trigger(cls, trigger, trigger_args):
+    def parse_trigger(cls, trigger, trigger_args, job_id=None):
+        jitter = settings.SCHEDULE_JITTER or None
         if trigger == 'interval':
-            return IntervalTrigger(seconds=int(trigger_args), timezone=cls.timezone)
+            interval = int(trigger_args)
+            start_date = phase_start_date(job_id, interval) if job_id is not None else None
+            return IntervalTrigger(seconds=interval, start_date=start_date, jitter=jitter, timezone=cls.timezone)
         elif trigger == 'date':
             return DateTrigger(run_date=trigger_args, timezone=cls.timezone)
         elif trigger == 'cron':
@@ -55,7 +59,7 @@ class Scheduler:
             minute, hour, day, month, week = args['rule'].split()
             week = cls.week_map[week]
             return CronTrigger(minute=minute, hour=hour, day=day, month=month, day_of_week=week,
-                               start_date=args['start'], end_date=args['stop'])
+                               start_date=args['start'], end_date=args['stop'], jitter=jitter)
         else:
             raise TypeError(f'unknown schedule policy: {trigger!r}')
 
@@ -65,6 +69,9 @@ class Scheduler:
         if event.code == EVENT_SCHEDULER_SHUTDOWN:
             logger.info(f'EVENT_SCHEDULER_SHUTDOWN: {event}')
             Notify.make_notify('schedule', '1', '调度器已关闭', '调度器意外关闭，你可以在github上提交issue')
+        elif event.code in (EVENT_JOB_MAX_INSTANCES, EVENT_JOB_ERROR) and not (str(event.job_id).isdigit() and obj):
+            # 内置任务（例如定期采集主机信息）或已删除的任务，仅记录日志
+            logger.error(f'job {event.job_id} event {event.code}: {getattr(event, "exception", None)}')
         elif event.code == EVENT_JOB_MAX_INSTANCES:
             logger.info(f'EVENT_JOB_MAX_INSTANCES: {event}')
             send_fail_notify(obj, '达到调度实例上限，一般为上个周期的执行任务还未结束，请增加调度间隔或减少任务执行耗时')
@@ -89,12 +96,13 @@ class Scheduler:
     def _init_builtin_jobs(self):
         self.scheduler.add_job(auto_clean_records, 'cron', hour=0, minute=0)
         self.scheduler.add_job(auto_clean_schedule_history, 'cron', hour=0, minute=0)
+        self.scheduler.add_job(auto_refresh_facts, 'interval', minutes=10)
 
     def _init(self):
         self.scheduler.start()
         self._init_builtin_jobs()
         for task in Task.objects.filter(is_active=True):
-            trigger = self.parse_trigger(task.trigger, task.trigger_args)
+            trigger = self.parse_trigger(task.trigger, task.trigger_args, task.id)
             self.scheduler.add_job(
                 dispatch,
                 trigger,
@@ -111,7 +119,7 @@ class Scheduler:
             _, data = rds_cli.brpop(settings.SCHEDULE_KEY)
             task = AttrDict(json.loads(data))
             if task.action in ('add', 'modify'):
-                trigger = self.parse_trigger(task.trigger, task.trigger_args)
+                trigger = self.parse_trigger(task.trigger, task.trigger_args, task.id)
                 self.scheduler.add_job(
                     dispatch,
                     trigger,
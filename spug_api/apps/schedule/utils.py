@@ -2,10 +2,8 @@
 # Copyright: (c) <spug.dev@gmail.com>
 # Released under the AGPL-3.0 License.
 from apps.schedule.models import Task, History
-from apps.notify.models import Notify
+from apps.notify.outbox import push
 from libs.utils import human_datetime
-from threading import Thread
-import requests
 import json
 
 
@@ -23,7 +21,7 @@ def send_fail_notify(task, msg=None):
     mode = rst_notify.get('mode')
     url = rst_notify.get('value')
     if mode != '0' and url:
-        Thread(target=_do_notify, args=(task, mode, url, msg)).start()
+        _do_notify(task, mode, url, msg)
 
 
 def _do_notify(task, mode, url, msg):
@@ -43,7 +41,7 @@ def _do_notify(task, mode, url, msg):
                 'text': '\n\n'.join(texts)
             }
         }
-        requests.post(url, json=data)
+        push(url, data, 'schedule', '任务执行通知发送失败', 'dd')
     elif mode == '2':
         data = {
             'task_id': task.id,
@@ -52,7 +50,7 @@ def _do_notify(task, mode, url, msg):
             'message': msg or '请在任务计划执行历史中查看详情',
             'created_at': human_datetime()
         }
-        requests.post(url, json=data)
+        push(url, data, 'schedule', '任务执行通知发送失败')
     elif mode == '3':
         texts = [
             '## <font color="warning">任务执行失败通知</font>',
@@ -68,10 +66,4 @@ def _do_notify(task, mode, url, msg):
                 'content': '\n'.join(texts)
             }
         }
-        res = requests.post(url, json=data)
-        if res.status_code != 200:
-            Notify.make_notify('schedule', '1', '任务执行通知发送失败', f'返回状态码：{res.status_code}, 请求URL：{url}')
-        if mode in ['1', '3']:
-            res = res.json()
-            if res.get('errcode') != 0:
-                Notify.make_notify('schedule', '1', '任务执行通知发送失败', f'返回数据：{res}')
+        push(url, data, 'schedule', '任务执行通知发送失败', 'wx')
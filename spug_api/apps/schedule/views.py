@@ -10,7 +10,7 @@ from apps.schedule.models import Task, History
 from apps.schedule.executors import dispatch
 from apps.host.models import Host
 from django.conf import settings
-from libs import json_response, JsonParser, Argument, human_datetime
+from libs import json_response, JsonParser, Argument, human_datetime, fire_histogram
 import json
 
 
@@ -52,13 +52,16 @@ class Schedule(View):
                     **form
                 )
                 task = Task.objects.filter(pk=form.id).first()
+                if task:
+                    task.sync_refs()
                 if task and task.is_active:
                     form.action = 'modify'
                     form.targets = json.loads(form.targets)
                     rds_cli = get_redis_connection()
                     rds_cli.lpush(settings.SCHEDULE_KEY, json.dumps(form))
             else:
-                Task.objects.create(created_by=request.user, **form)
+                task = Task.objects.create(created_by=request.user, **form)
+                task.sync_refs()
         return json_response(error=error)
 
     def patch(self, request):
@@ -165,3 +168,15 @@ def next_run_time(request):
         else:
             return json_response({'success': False, 'msg': '无法被触发'})
     return json_response(error=error)
+
+
+def get_load(request):
+    form, error = JsonParser(
+        Argument('cycle', type=int, default=3600, filter=lambda x: 60 <= x <= 86400, help='请输入60~86400之间的统计周期'),
+    ).parse(request.GET)
+    if error is None:
+        triggers = []
+        for task in Task.objects.filter(is_active=True):
+            triggers.append(Scheduler.parse_trigger(task.trigger, task.trigger_args, task.id))
+        return json_response(fire_histogram(triggers, form.cycle))
+    return json_response(error=error)
@@ -7,9 +7,9 @@ from django.conf import settings
 from libs import JsonParser, Argument, json_response
 from apps.setting.utils import AppSetting
 from apps.setting.models import Setting
+from libs.mail import Mail
 import platform
 import ldap
-import smtplib
 
 
 class SettingView(View):
@@ -54,12 +54,8 @@ def email_test(request):
     ).parse(request.body)
     if error is None:
         try:
-            if form.port == 465:
-                server = smtplib.SMTP_SSL(form.server, form.port, timeout=3)
-            else:
-                server = smtplib.SMTP(form.server, form.port, timeout=3)
-            server.login(form.username, form.password)
-            return json_response()    
+            mail = Mail(form.server, form.port, form.username, form.password)
+            return json_response(mail.probe())
 
         except Exception as e:
             error = f'{e}'
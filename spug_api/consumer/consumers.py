@@ -3,7 +3,7 @@
 # Released under the AGPL-3.0 License.
 from channels.generic.websocket import WebsocketConsumer
 from django_redis import get_redis_connection
-from apps.account.models import User
+from apps.account.utils import get_user_by_token
 from apps.host.models import Host
 from threading import Thread
 import json
@@ -70,7 +70,7 @@ class SSHConsumer(WebsocketConsumer):
         # print('Connection close')
 
     def connect(self):
-        user = User.objects.filter(access_token=self.token).first()
+        user = get_user_by_token(self.token)
         if user and user.token_expired >= time.time() and user.is_active and user.has_host_perm(self.id):
             self.accept()
             self._init()
@@ -3,8 +3,13 @@
 # Released under the AGPL-3.0 License.
 from django.urls import path
 from .consumers import *
+from .watchers import ConfigWatchConsumer
 
 websocket_urlpatterns = [
     path('ws/exec/<str:token>/', ExecConsumer),
     path('ws/ssh/<str:token>/<int:id>/', SSHConsumer),
 ]
+
+http_urlpatterns = [
+    path('apis/config/watch/', ConfigWatchConsumer),
+]
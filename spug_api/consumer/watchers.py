@@ -0,0 +1,105 @@
+# Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
+# Copyright: (c) <spug.dev@gmail.com>
+# Released under the AGPL-3.0 License.
+from channels.generic.http import AsyncHttpConsumer
+from channels.db import database_sync_to_async
+from django_redis import get_redis_connection
+from django.http import QueryDict
+from apps.apis.config import FORMATS, get_snapshot, _parse_params
+from apps.config.utils import CONFIG_VERSION_KEY
+from libs import AttrDict
+from threading import Thread, Lock
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger('django.apps.config')
+
+WATCH_TIMEOUT = 30
+MAX_WATCH_TIMEOUT = 120
+
+
+class ConfigHub:
+    """
+    每个进程仅保持一个Redis订阅，配置版本变更时唤醒所有等待中的请求
+    """
+
+    def __init__(self):
+        self.waiters = {}
+        self.lock = Lock()
+        self.thread = None
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = get_redis_connection().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CONFIG_VERSION_KEY)
+                # 订阅(重新)建立期间可能错过变更通知，统一唤醒一次由请求自行比对
+                self._wake()
+                for _ in pubsub.listen():
+                    self._wake()
+            except Exception as e:
+                logger.error(f'config watch subscription error: {e}')
+                time.sleep(1)
+
+    def _wake(self):
+        with self.lock:
+            waiters, self.waiters = self.waiters, {}
+        for future, loop in waiters.items():
+            loop.call_soon_threadsafe(_set_done, future)
+
+    def subscribe(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self._listen, daemon=True)
+                self.thread.start()
+            loop = asyncio.get_event_loop()
+            future = loop.create_future()
+            self.waiters[future] = loop
+        return future
+
+    def discard(self, future):
+        with self.lock:
+            self.waiters.pop(future, None)
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(True)
+
+
+hub = ConfigHub()
+
+
+class ConfigWatchConsumer(AsyncHttpConsumer):
+    """
+    配置变更长轮询，version 为上次获取到的 ETag，配置内容变化时立即返回新配置，
+    超时仍无变化则返回304
+    """
+
+    async def handle(self, body):
+        request = AttrDict(GET=QueryDict(self.scope['query_string']))
+        app, env_id, no_prefix = await database_sync_to_async(_parse_params)(request)
+        if not app or not env_id:
+            return await self.send_response(400, b'Invalid params')
+        fmt = request.GET.get('format', 'kv')
+        if fmt not in FORMATS:
+            return await self.send_response(400, b'Unsupported output format')
+        try:
+            timeout = min(int(request.GET.get('timeout', WATCH_TIMEOUT)), MAX_WATCH_TIMEOUT)
+        except ValueError:
+            timeout = WATCH_TIMEOUT
+        version = request.GET.get('version', '').strip('"')
+        deadline = time.time() + timeout
+        while True:
+            future = hub.subscribe()
+            try:
+                output, etag = await database_sync_to_async(get_snapshot)(app, env_id, no_prefix, fmt)
+                if etag.strip('"') != version:
+                    headers = [(b'Content-Type', FORMATS[fmt].encode()), (b'ETag', etag.encode())]
+                    return await self.send_response(200, output.encode(), headers=headers)
+                await asyncio.wait_for(future, max(deadline - time.time(), 0))
+            except asyncio.TimeoutError:
+                return await self.send_response(304, b'', headers=[(b'ETag', etag.encode())])
+            finally:
+                hub.discard(future)
@@ -1,7 +1,19 @@
 from email.header import Header
 from email.mime.text import MIMEText
 from email.utils import formataddr
+from threading import Lock, Timer
 import smtplib
+import logging
+import time
+
+logger = logging.getLogger('django.apps.notify')
+
+# 同一收件人的邮件合并发送的时间窗口(秒)
+BATCH_WINDOW = 3
+# 单封合并邮件最多包含的通知条数
+BATCH_SIZE = 50
+# 发送一封邮件所需的指令往返次数(MAIL FROM/RCPT TO/DATA/结束符)
+MAIL_ROUND_TRIPS = 4
 
 
 class Mail:
@@ -12,18 +24,127 @@ class Mail:
         self.password = password
         self.nickname = nickname
 
-    def _get_server(self):
+    def _get_server(self, timeout=30):
         if self.port == 465:
-            server = smtplib.SMTP_SSL(self.host, self.port)
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=timeout)
         else:
-            server = smtplib.SMTP(self.host, self.port)
+            server = smtplib.SMTP(self.host, self.port, timeout=timeout)
         server.login(self.user, self.password)
         return server
 
-    def send_text_mail(self, receivers, subject, body):
-        server = self._get_server()
+    def make_message(self, subject, body):
         msg = MIMEText(body, 'plain', 'utf-8')
         msg['Subject'] = Header(subject, 'utf-8')
         msg['From'] = formataddr((self.nickname, self.user)) if self.nickname else self.user
-        server.sendmail(self.user, receivers, msg.as_string())
+        return msg.as_string()
+
+    def send_text_mail(self, receivers, subject, body):
+        server = self._get_server()
+        server.sendmail(self.user, receivers, self.make_message(subject, body))
+        server.quit()
+
+    def probe(self, rounds=5, timeout=3):
+        """
+        测试邮件服务，返回建立连接并登录的耗时、单条指令的平均往返耗时(毫秒)，
+        以及据此估算的单连接每分钟可发送邮件数
+        """
+        start = time.time()
+        server = self._get_server(timeout)
+        connect = (time.time() - start) * 1000
+        start = time.time()
+        for _ in range(rounds):
+            server.noop()
+        rtt = (time.time() - start) * 1000 / rounds
         server.quit()
+        return {
+            'connect': round(connect),
+            'rtt': round(rtt, 1),
+            'throughput': int(60000 / (rtt * MAIL_ROUND_TRIPS + 1))
+        }
+
+
+class MailTransport:
+    """
+    保持登录状态的SMTP长连接，连接断开时自动重连；
+    同一组收件人在 window 秒内的多条通知合并为一封邮件发送
+    """
+
+    def __init__(self, mail, window=BATCH_WINDOW, on_error=None):
+        self.mail = mail
+        self.window = window
+        self.on_error = on_error
+        self.server = None
+        self.pending = {}
+        self.lock = Lock()
+        self.send_lock = Lock()
+
+    def send(self, receivers, subject, body):
+        key = tuple(sorted(receivers))
+        with self.lock:
+            items = self.pending.setdefault(key, [])
+            items.append((subject, body))
+            if len(items) == 1:
+                timer = Timer(self.window, self._flush, args=(key,))
+                timer.daemon = True
+                timer.start()
+
+    def close(self):
+        with self.send_lock:
+            self._close()
+
+    def _close(self):
+        if self.server:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+    def _flush(self, key):
+        with self.lock:
+            items = self.pending.pop(key, [])
+        for i in range(0, len(items), BATCH_SIZE):
+            chunk = items[i:i + BATCH_SIZE]
+            if len(chunk) == 1:
+                subject, body = chunk[0]
+            else:
+                subject = f'{chunk[0][0]} 等{len(chunk)}条通知'
+                body = f'\r\n\r\n{"-" * 40}\r\n\r\n'.join(x[1] for x in chunk)
+            try:
+                self._deliver(list(key), subject, body)
+            except Exception as e:
+                logger.error(f'send mail failed: {e}')
+                if self.on_error:
+                    self.on_error(f'异常信息：{e}, 收件人：{", ".join(key)}')
+
+    def _deliver(self, receivers, subject, body):
+        message = self.mail.make_message(subject, body)
+        with self.send_lock:
+            for attempt in range(2):
+                try:
+                    if self.server is None:
+                        self.server = self.mail._get_server()
+                    self.server.sendmail(self.mail.user, receivers, message)
+                    return
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError):
+                    self._close()
+                    if attempt:
+                        raise
+
+
+_transports = {}
+_transports_lock = Lock()
+
+
+def get_transport(mail_service, on_error=None):
+    """
+    按邮件服务配置复用发送通道，配置变更后关闭旧的连接
+    """
+    key = tuple(sorted(mail_service.items()))
+    with _transports_lock:
+        if key not in _transports:
+            for transport in _transports.values():
+                transport.close()
+            _transports.clear()
+            _transports[key] = MailTransport(Mail(**mail_service), on_error=on_error)
+        return _transports[key]
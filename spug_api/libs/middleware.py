@@ -4,7 +4,7 @@
 from django.utils.deprecation import MiddlewareMixin
 from django.conf import settings
 from .utils import json_response
-from apps.account.models import User
+from apps.account.utils import get_user_by_token, refresh_token
 import traceback
 import time
 
@@ -32,11 +32,10 @@ class AuthenticationMiddleware(MiddlewareMixin):
         access_token = request.headers.get('x-token') or request.GET.get('x-token')
         if access_token and len(access_token) == 32:
             x_real_ip = request.headers.get('x-real-ip', '')
-            user = User.objects.filter(access_token=access_token).first()
+            user = get_user_by_token(access_token)
             if user and x_real_ip == user.last_ip and user.token_expired >= time.time() and user.is_active:
                 request.user = user
-                user.token_expired = time.time() + 8 * 60 * 60
-                user.save()
+                refresh_token(user)
                 return None
         response = json_response(error="验证失败，请重新登录")
         response.status_code = 401
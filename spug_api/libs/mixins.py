@@ -18,6 +18,16 @@ class ModelMixin(object):
         else:
             return {f.attname: getattr(self, f.attname) for f in self._meta.fields}
 
+    def set_refs(self, name, values):
+        """
+        将json字段中保存的关联id同步到多对多关联表，忽略非数字及已不存在的id
+        """
+        manager = getattr(self, name)
+        ids = {int(x) for x in values or [] if str(x).isdigit()}
+        if ids:
+            ids = manager.model.objects.filter(id__in=ids).values_list('id', flat=True)
+        manager.set(list(ids))
+
 
 # 使用该混入类，需要request.user对象实现has_perms方法
 class PermissionMixin(object):
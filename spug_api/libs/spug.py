@@ -1,12 +1,13 @@
 # Copyright: (c) OpenSpug Organization. https://github.com/openspug/spug
 # Copyright: (c) <spug.dev@gmail.com>
 # Released under the AGPL-3.0 License.
-from apps.alarm.models import Group, Contact
+from django.db import close_old_connections
+from apps.alarm.utils import get_recipients
 from apps.setting.utils import AppSetting
 from apps.notify.models import Notify
-from libs.mail import Mail
+from apps.notify.outbox import push
+from libs.mail import get_transport
 from libs.utils import human_datetime
-import requests
 import json
 
 spug_server = 'http://spug-wx.qbangmang.com'
@@ -15,28 +16,25 @@ notify_source = 'monitor'
 
 def _parse_args(grp):
     spug_key = AppSetting.get_default('spug_key')
-    return spug_key, sum([json.loads(x.contacts) for x in Group.objects.filter(id__in=grp)], [])
+    return spug_key, get_recipients(grp)
 
 
-def _handle_response(res, mode):
-    if res.status_code != 200:
-        Notify.make_notify(notify_source, '1', '告警通知发送失败', f'返回状态码：{res.status_code}, 请求URL：{res.url}')
-    if mode in ['dd', 'wx']:
-        res = res.json()
-        if res.get('errcode') != 0:
-            Notify.make_notify(notify_source, '1', '告警通知发送失败', f'返回数据：{res}')
-    if mode == 'spug':
-        res = res.json()
-        if res.get('error'):
-            Notify.make_notify(notify_source, '1', '告警通知发送失败', f'错误信息：{res}')
+def _push(url, data, mode):
+    push(url, data, notify_source, '告警通知发送失败', mode)
+
+
+def _mail_error(error):
+    # 在邮件批量发送的定时线程中调用，需先清理失效的数据库连接
+    close_old_connections()
+    Notify.make_notify(notify_source, '1', '告警邮件发送失败', error)
 
 
 def notify_by_wx(event, obj):
-    spug_key, u_ids = _parse_args(obj.grp)
+    spug_key, recipients = _parse_args(obj.grp)
     if not spug_key:
         Notify.make_notify(notify_source, '1', '发送报警信息失败', '未配置报警服务调用凭据，请在系统管理/系统设置/报警服务设置中配置。')
         return
-    users = set(x.wx_token for x in Contact.objects.filter(id__in=u_ids, wx_token__isnull=False))
+    users = recipients['wx_token']
     if users:
         data = {
             'token': spug_key,
@@ -44,17 +42,16 @@ def notify_by_wx(event, obj):
             'subject': obj.name,
             'desc': obj.out,
             'remark': f'故障持续{obj.duration}' if event == '2' else None,
-            'users': list(users)
+            'users': users
         }
-        res = requests.post(f'{spug_server}/apis/notify/wx/', json=data)
-        _handle_response(res, 'spug')
+        _push(f'{spug_server}/apis/notify/wx/', data, 'spug')
     else:
         Notify.make_notify(notify_source, '1', '发送报警信息失败', '未找到可用的通知对象，请确保设置了相关报警联系人的微信Token。')
 
 
 def notify_by_email(event, obj):
-    spug_key, u_ids = _parse_args(obj.grp)
-    users = set(x.email for x in Contact.objects.filter(id__in=u_ids, email__isnull=False))
+    spug_key, recipients = _parse_args(obj.grp)
+    users = recipients['email']
     if users:
         mail_service = json.loads(AppSetting.get_default('mail_service', '{}'))
         body = ['告警名称：' + obj.name, '告警时间：' + human_datetime(), '告警描述：' + obj.out]
@@ -63,18 +60,17 @@ def notify_by_email(event, obj):
         if mail_service.get('server'):
             event_map = {'1': '告警发生', '2': '告警恢复'}
             subject = f'{event_map[event]}-{obj.name}'
-            mail = Mail(**mail_service)
-            mail.send_text_mail(users, subject, '\r\n'.join(body) + '\r\n\r\n自动发送，请勿回复。')
+            transport = get_transport(mail_service, _mail_error)
+            transport.send(users, subject, '\r\n'.join(body) + '\r\n\r\n自动发送，请勿回复。')
         elif spug_key:
             data = {
                 'token': spug_key,
                 'event': event,
                 'subject': obj.name,
                 'body': '\r\n'.join(body),
-                'users': list(users)
+                'users': users
             }
-            res = requests.post(f'{spug_server}/apis/notify/mail/', json=data)
-            _handle_response(res, 'spug')
+            _push(f'{spug_server}/apis/notify/mail/', data, 'spug')
         else:
             Notify.make_notify(notify_source, '1', '发送报警信息失败', '未配置报警服务调用凭据，请在系统管理/系统设置/报警服务设置中配置。')
     else:
@@ -82,8 +78,8 @@ def notify_by_email(event, obj):
 
 
 def notify_by_dd(event, obj):
-    _, u_ids = _parse_args(obj.grp)
-    users = set(x.ding for x in Contact.objects.filter(id__in=u_ids, ding__isnull=False))
+    _, recipients = _parse_args(obj.grp)
+    users = recipients['ding']
     if users:
         texts = [
             '## %s ## ' % ('监控告警通知' if event == '1' else '告警恢复通知'),
@@ -101,15 +97,14 @@ def notify_by_dd(event, obj):
             }
         }
         for url in users:
-            res = requests.post(url, json=data)
-            _handle_response(res, 'dd')
+            _push(url, data, 'dd')
     else:
         Notify.make_notify(notify_source, '1', '发送报警信息失败', '未找到可用的通知对象，请确保设置了相关报警联系人的钉钉。')
 
 
 def notify_by_qy_wx(event, obj):
-    _, u_ids = _parse_args(obj.grp)
-    users = set(x.qy_wx for x in Contact.objects.filter(id__in=u_ids, qy_wx__isnull=False))
+    _, recipients = _parse_args(obj.grp)
+    users = recipients['qy_wx']
     if users:
         color, title = ('warning', '监控告警通知') if event == '1' else ('info', '告警恢复通知')
         texts = [
@@ -127,7 +122,6 @@ def notify_by_qy_wx(event, obj):
             }
         }
         for url in users:
-            res = requests.post(url, json=data)
-            _handle_response(res, 'wx')
+            _push(url, data, 'wx')
     else:
         Notify.make_notify(notify_source, '1', '发送报警信息失败', '未找到可用的通知对象，请确保设置了相关报警联系人的企业微信。')
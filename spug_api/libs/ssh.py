@@ -6,6 +6,98 @@ from paramiko.config import SSH_PORT
 from paramiko.rsakey import RSAKey
 from paramiko.ssh_exception import AuthenticationException
 from io import StringIO
+import codecs
+import socket
+import re
+
+# 截断模式下默认保留的输出开头、末尾字节数
+CAPTURE_HEAD = 32 * 1024
+CAPTURE_TAIL = 32 * 1024
+CHUNK_SIZE = 32 * 1024
+# 流式输出中未遇到换行的内容，超过该时长(秒)或字节数后也立即输出
+FLUSH_INTERVAL = 0.5
+FLUSH_SIZE = 4096
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+def decode_output(out: bytes):
+    try:
+        return out.decode()
+    except UnicodeDecodeError:
+        try:
+            return out.decode('GBK')
+        except UnicodeDecodeError:
+            # 截断处可能切断多字节字符
+            return out.decode(errors='replace')
+
+
+class StreamDecoder:
+    """
+    增量解码输出流，读取边界处被切断的多字节字符会等待后续数据再解码；
+    编码仅判定一次：首次成功解码非ASCII内容后固定为UTF-8，UTF-8解码失败则整条流改用GBK
+    """
+
+    def __init__(self):
+        self.encoding = None
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def decode(self, data, final=False):
+        if self.encoding:
+            return self.decoder.decode(data, final)
+        try:
+            text = self.decoder.decode(data, final)
+        except UnicodeDecodeError:
+            pending = self.decoder.getstate()[0]
+            self.encoding = 'GBK'
+            self.decoder = codecs.getincrementaldecoder('GBK')(errors='replace')
+            return self.decoder.decode(pending + data, final)
+        if _NON_ASCII.search(text):
+            self.encoding = 'utf-8'
+            self.decoder.errors = 'replace'
+        return text
+
+
+class OutputCapture:
+    """
+    流式接收命令输出，仅保留开头 head 字节与末尾 tail 字节，同时统计总字节数，
+    内存占用不超过 head + 2 * tail
+    """
+
+    def __init__(self, head=CAPTURE_HEAD, tail=CAPTURE_TAIL):
+        self.head = head
+        self.tail = tail
+        self.head_buf = bytearray()
+        self.tail_buf = bytearray()
+        self.total = 0
+
+    def write(self, data):
+        self.total += len(data)
+        if len(self.head_buf) < self.head:
+            size = self.head - len(self.head_buf)
+            self.head_buf += data[:size]
+            data = data[size:]
+        if data and self.tail:
+            self.tail_buf += data
+            if len(self.tail_buf) > self.tail * 2:
+                del self.tail_buf[:-self.tail]
+
+    def read_from(self, read):
+        data = read(CHUNK_SIZE)
+        while data:
+            self.write(data)
+            data = read(CHUNK_SIZE)
+        return self
+
+    @property
+    def omitted(self):
+        return self.total - len(self.head_buf) - min(len(self.tail_buf), self.tail)
+
+    def getvalue(self):
+        tail = bytes(self.tail_buf[-self.tail:]) if self.tail else b''
+        if self.omitted <= 0:
+            return decode_output(bytes(self.head_buf) + tail)
+        marker = f'\n... 输出过长，已省略 {self.omitted} 字节（共 {self.total} 字节） ...\n'
+        return decode_output(bytes(self.head_buf)) + marker + decode_output(tail)
 
 
 class SSH:
@@ -55,35 +147,60 @@ class SSH:
             sftp.put(local_path, remote_path)
             sftp.close()
 
-    def exec_command(self, command, timeout=1800, environment=None):
-        command = 'set -e\n' + command
+    def exec_command(self, command, timeout=1800, environment=None, capture=None):
+        """
+        capture 为 (head, tail) 时以流式读取输出，仅保留开头和末尾的指定字节数，
+        中间以截断标记代替，避免输出过大时占用过多内存
+        """
+        with self as cli:
+            chan = self._open_channel(cli, command, timeout, environment)
+            out = self._read_output(chan, capture)
+            return chan.recv_exit_status(), out
+
+    def exec_commands(self, commands, timeout=1800, environment=None, max_sessions=10, capture=None):
+        """
+        复用同一个连接执行多条命令，每条命令使用独立的channel，
+        受sshd MaxSessions限制（默认10）分批并发执行，按顺序返回 (exit_code, output) 列表
+        """
+        results = []
         with self as cli:
-            chan = cli.get_transport().open_session()
-            chan.settimeout(timeout)
-            chan.set_combine_stderr(True)
-            if environment:
-                str_env = ' '.join(f"{k}='{v}'" for k, v in environment.items())
-                command = f'export {str_env} && {command}'
-            chan.exec_command(command)
-            stdout = chan.makefile("rb", -1)
-            return chan.recv_exit_status(), self._decode(stdout.read())
+            for i in range(0, len(commands), max_sessions):
+                channels = [self._open_channel(cli, x, timeout, environment) for x in commands[i:i + max_sessions]]
+                for chan in channels:
+                    out = self._read_output(chan, capture)
+                    results.append((chan.recv_exit_status(), out))
+        return results
 
     def exec_command_with_stream(self, command, timeout=1800, environment=None):
-        command = 'set -e\n' + command
+        """
+        按块读取并增量解码输出，每次产出截至最后一个换行符或回车符的完整内容，
+        未换行的内容(例如进度条)在 FLUSH_INTERVAL 秒内无新数据或超过 FLUSH_SIZE 时直接产出
+        """
         with self as cli:
-            chan = cli.get_transport().open_session()
-            chan.settimeout(timeout)
-            chan.set_combine_stderr(True)
-            if environment:
-                str_env = ' '.join(f"{k}='{v}'" for k, v in environment.items())
-                command = f'export {str_env} && {command}'
-            chan.exec_command(command)
-            stdout = chan.makefile("rb", -1)
-            out = stdout.readline()
-            while out:
-                yield chan.exit_status, self._decode(out)
-                out = stdout.readline()
-            yield chan.recv_exit_status(), self._decode(out)
+            chan = self._open_channel(cli, command, timeout, environment)
+            decoder, pending = StreamDecoder(), ''
+            while True:
+                chan.settimeout(FLUSH_INTERVAL if pending else timeout)
+                try:
+                    data = chan.recv(CHUNK_SIZE)
+                except socket.timeout:
+                    if not pending:
+                        raise
+                    yield chan.exit_status, pending
+                    pending = ''
+                    continue
+                if not data:
+                    break
+                pending += decoder.decode(data)
+                index = max(pending.rfind('\n'), pending.rfind('\r')) + 1
+                if len(pending) >= FLUSH_SIZE:
+                    out, pending = pending, ''
+                elif index:
+                    out, pending = pending[:index], pending[index:]
+                else:
+                    continue
+                yield chan.exit_status, out
+            yield chan.recv_exit_status(), pending + decoder.decode(b'', True)
 
     def put_file_by_fl(self, fl, remote_path, callback=None):
         with self as cli:
@@ -100,11 +217,25 @@ class SSH:
             sftp = cli.open_sftp()
             sftp.remove(path)
 
+    def _open_channel(self, cli, command, timeout, environment):
+        command = 'set -e\n' + command
+        chan = cli.get_transport().open_session()
+        chan.settimeout(timeout)
+        chan.set_combine_stderr(True)
+        if environment:
+            str_env = ' '.join(f"{k}='{v}'" for k, v in environment.items())
+            command = f'export {str_env} && {command}'
+        chan.exec_command(command)
+        return chan
+
+    def _read_output(self, chan, capture):
+        if capture:
+            return OutputCapture(*capture).read_from(chan.recv).getvalue()
+        stdout = chan.makefile("rb", -1)
+        return self._decode(stdout.read())
+
     def _decode(self, out: bytes):
-        try:
-            return out.decode()
-        except UnicodeDecodeError:
-            return out.decode('GBK')
+        return decode_output(out)
 
     def __enter__(self):
         if self.client is not None:
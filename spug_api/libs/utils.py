@@ -3,11 +3,14 @@
 # Released under the AGPL-3.0 License.
 from django.http.response import HttpResponse
 from django.db.models import QuerySet
-from datetime import datetime, date as datetime_date
+from datetime import datetime, timedelta, date as datetime_date
 from decimal import Decimal
+from pytz import utc
 import string
 import random
 import json
+import time
+import zlib
 
 
 # 转换时间格式到字符串
@@ -102,3 +105,25 @@ class DateTimeEncoder(json.JSONEncoder):
 def generate_random_str(length: int = 4, is_digits: bool = True) -> str:
     words = string.digits if is_digits else string.ascii_letters + string.digits
     return ''.join(random.sample(words, length))
+
+
+# 根据key计算固定的相位偏移，返回可作为间隔触发器start_date的时间，
+# 使相同间隔的任务均匀分布在周期内，且重启后保持不变
+def phase_start_date(key, interval):
+    offset = zlib.crc32(str(key).encode()) % interval
+    return datetime.fromtimestamp(offset, tz=utc)
+
+
+# 统计一组触发器在当前周期内每一秒的触发次数
+def fire_histogram(triggers, cycle=3600):
+    now = int(time.time())
+    start = now - now % cycle
+    start_date = datetime.fromtimestamp(start, tz=utc)
+    end_date = start_date + timedelta(seconds=cycle)
+    data = [0] * cycle
+    for trigger in triggers:
+        fire_time = trigger.get_next_fire_time(None, start_date)
+        while fire_time and fire_time < end_date:
+            data[int(fire_time.timestamp()) - start] += 1
+            fire_time = trigger.get_next_fire_time(fire_time, fire_time + timedelta(seconds=1))
+    return {'cycle': cycle, 'total': sum(data), 'max': max(data), 'data': data}
@@ -2,6 +2,8 @@
 # Copyright: (c) <spug.dev@gmail.com>
 # Released under the AGPL-3.0 License.
 from channels.routing import ProtocolTypeRouter, ChannelNameRouter, URLRouter
+from channels.http import AsgiHandler
+from django.urls import re_path
 from consumer import routing, executors
 
 application = ProtocolTypeRouter({
@@ -10,5 +12,8 @@ application = ProtocolTypeRouter({
     }),
     'websocket': URLRouter(
         routing.websocket_urlpatterns
+    ),
+    'http': URLRouter(
+        routing.http_urlpatterns + [re_path(r'', AsgiHandler)]
     )
 })
@@ -103,7 +103,20 @@ TEMPLATES = [
 SCHEDULE_KEY = 'spug:schedule'
 MONITOR_KEY = 'spug:monitor'
 REQUEST_KEY = 'spug:request'
+NOTIFY_KEY = 'spug:notify'
+DEPLOY_KEY = 'spug:deploy'
+# number of rundeployer worker processes
+DEPLOY_WORKERS = 4
+# max random delay (seconds) added to each scheduled run, 0 to disable
+MONITOR_JITTER = 0
+SCHEDULE_JITTER = 0
+# alerts of the same notify group within this window (seconds) are merged into one digest, 0 to disable
+MONITOR_NOTIFY_WINDOW = 10
+# host facts older than this (seconds) are refreshed by the scheduler, at most HOST_FACTS_BATCH hosts per run
+HOST_FACTS_MAX_AGE = 6 * 3600
+HOST_FACTS_BATCH = 200
 REPOS_DIR = os.path.join(BASE_DIR, 'repos')
+DEPLOY_LOGS_DIR = os.path.join(BASE_DIR, 'logs', 'deploy')
 
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
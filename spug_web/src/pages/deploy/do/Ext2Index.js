@@ -43,8 +43,8 @@ class Ext1Index extends React.Component {
       .then(res => {
         store.request = res;
         const outputs = {};
-        while (res.outputs.length) {
-          const msg = JSON.parse(res.outputs.pop());
+        for (let item of res.outputs) {
+          const msg = JSON.parse(item);
           if (!outputs.hasOwnProperty(msg.key)) {
             const data = msg.key === 'local' ? ['读取数据...        '] : [];
             outputs[msg.key] = {data}
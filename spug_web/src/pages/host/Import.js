@@ -5,7 +5,7 @@
  */
 import React from 'react';
 import { observer } from 'mobx-react';
-import { Modal, Form, Input, Upload, Icon, Button, Tooltip, Alert } from 'antd';
+import { Modal, Form, Input, Upload, Icon, Button, Tooltip, Alert, Progress, message } from 'antd';
 import http from 'libs/http';
 import store from './store';
 
@@ -17,42 +17,73 @@ class ComImport extends React.Component {
       loading: false,
       password: null,
       fileList: [],
+      progress: null,
     }
   }
 
+  componentWillUnmount() {
+    if (this.socket) this.socket.close()
+  }
+
   handleSubmit = () => {
     this.setState({loading: true});
     const formData = new FormData();
     formData.append('file', this.state.fileList[0]);
     if (this.state.password) formData.append('password', this.state.password);
-    http.post('/api/host/import/', formData, {timeout: 120000})
-      .then(res => {
-        Modal.info({
-          title: '导入结果',
-          content: <Form labelCol={{span: 7}} wrapperCol={{span: 14}}>
-            <Form.Item style={{margin: 0}} label="导入成功">{res.success.length}</Form.Item>
-            {res['fail'].length > 0 && <Form.Item style={{margin: 0, color: '#1890ff'}} label="验证失败">
-              <Tooltip title={`相关行：${res['fail'].join(', ')}`}>{res['fail'].length}</Tooltip>
-            </Form.Item>}
-            {res['network'].length > 0 && <Form.Item style={{margin: 0, color: '#1890ff'}} label="网络错误">
-              <Tooltip title={`相关行：${res['network'].join(', ')}`}>{res['network'].length}</Tooltip>
-            </Form.Item>}
-            {res['skip'].length > 0 && <Form.Item style={{margin: 0, color: '#1890ff'}} label="重复数据">
-              <Tooltip title={`相关行：${res['skip'].join(', ')}`}>{res['skip'].length}</Tooltip>
-            </Form.Item>}
-            {res['invalid'].length > 0 && <Form.Item style={{margin: 0, color: '#1890ff'}} label="无效数据">
-              <Tooltip title={`相关行：${res['invalid'].join(', ')}`}>{res['invalid'].length}</Tooltip>
-            </Form.Item>}
-            {res['repeat'].length > 0 && <Form.Item style={{margin: 0, color: '#1890ff'}} label="重复主机名">
-              <Tooltip title={`相关行：${res['repeat'].join(', ')}`}>{res['repeat'].length}</Tooltip>
-            </Form.Item>}
-            {res['error'].length > 0 && <Form.Item style={{margin: 0, color: '#1890ff'}} label="其他错误">
-              <Tooltip title={`请通过新建主机查看具体错误信息，相关行：${res['error'].join(', ')}`}>{res['error'].length}</Tooltip>
-            </Form.Item>}
-          </Form>
-        })
-      })
-      .finally(() => this.setState({loading: false}))
+    http.post('/api/host/import/', formData)
+      .then(token => this.handleProgress(token), () => this.setState({loading: false}))
+  };
+
+  handleProgress = (token) => {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    this.socket = new WebSocket(`${protocol}//${window.location.host}/api/ws/exec/${token}/`);
+    this.socket.onopen = () => this.socket.send('ok');
+    this.socket.onmessage = e => {
+      if (e.data === 'pong') {
+        this.socket.send('ping')
+      } else {
+        const {type, data, done, total} = JSON.parse(e.data);
+        if (type === 'progress') {
+          this.setState({progress: {done, total}})
+        } else {
+          this.socket.close();
+          this.setState({loading: false, progress: null});
+          if (type === 'summary') {
+            this.showSummary(data);
+            store.fetchRecords()
+          } else {
+            message.error(data)
+          }
+        }
+      }
+    }
+  };
+
+  showSummary = (res) => {
+    Modal.info({
+      title: '导入结果',
+      content: <Form labelCol={{span: 7}} wrapperCol={{span: 14}}>
+        <Form.Item style={{margin: 0}} label="导入成功">{res.success.length}</Form.Item>
+        {res['fail'].length > 0 && <Form.Item style={{margin: 0, color: '#1890ff'}} label="验证失败">
+          <Tooltip title={`相关行：${res['fail'].join(', ')}`}>{res['fail'].length}</Tooltip>
+        </Form.Item>}
+        {res['network'].length > 0 && <Form.Item style={{margin: 0, color: '#1890ff'}} label="网络错误">
+          <Tooltip title={`相关行：${res['network'].join(', ')}`}>{res['network'].length}</Tooltip>
+        </Form.Item>}
+        {res['skip'].length > 0 && <Form.Item style={{margin: 0, color: '#1890ff'}} label="重复数据">
+          <Tooltip title={`相关行：${res['skip'].join(', ')}`}>{res['skip'].length}</Tooltip>
+        </Form.Item>}
+        {res['invalid'].length > 0 && <Form.Item style={{margin: 0, color: '#1890ff'}} label="无效数据">
+          <Tooltip title={`相关行：${res['invalid'].join(', ')}`}>{res['invalid'].length}</Tooltip>
+        </Form.Item>}
+        {res['repeat'].length > 0 && <Form.Item style={{margin: 0, color: '#1890ff'}} label="重复主机名">
+          <Tooltip title={`相关行：${res['repeat'].join(', ')}`}>{res['repeat'].length}</Tooltip>
+        </Form.Item>}
+        {res['error'].length > 0 && <Form.Item style={{margin: 0, color: '#1890ff'}} label="其他错误">
+          <Tooltip title={`请通过新建主机查看具体错误信息，相关行：${res['error'].join(', ')}`}>{res['error'].length}</Tooltip>
+        </Form.Item>}
+      </Form>
+    })
   };
 
   handleUpload = (v) => {
@@ -64,6 +95,7 @@ class ComImport extends React.Component {
   };
 
   render() {
+    const {progress} = this.state;
     return (
       <Modal
         visible
@@ -96,6 +128,12 @@ class ComImport extends React.Component {
               </Button>
             </Upload>
           </Form.Item>
+          {progress && (
+            <Form.Item label="验证进度">
+              <Progress percent={progress.total ? Math.round(progress.done * 100 / progress.total) : 100}
+                        format={() => `${progress.done}/${progress.total}`}/>
+            </Form.Item>
+          )}
         </Form>
       </Modal>
     )
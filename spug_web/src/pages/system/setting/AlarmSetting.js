@@ -28,8 +28,8 @@ class AlarmSetting extends React.Component {
     this.props.form.validateFields((error, data) => {
       if (!error) {
         this.setState({mail_test_loading: true});
-        http.post('/api/setting/email_test/', data).then(()=> {
-          message.success('邮件服务连接成功')
+        http.post('/api/setting/email_test/', data).then(res => {
+          message.success(`邮件服务连接成功，连接耗时${res.connect}ms，指令往返${res.rtt}ms，单连接预计每分钟可发送${res.throughput}封`)
         }).finally(()=> this.setState({mail_test_loading: false}))
       }
     })